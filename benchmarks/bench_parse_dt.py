@@ -0,0 +1,54 @@
+"""Compare the dateutil based timestamp parsing with AioPrices._parse_dt.
+
+Run from the root of the repo:
+    PYTHONPATH=custom_components python benchmarks/bench_parse_dt.py
+"""
+
+import json
+import pathlib
+import timeit
+
+from dateutil.parser import parse as parse_dt
+from pytz import timezone, utc
+
+from nordpool.aio_price import parse_utc
+
+PAYLOAD = pathlib.Path(__file__).parent / "data" / "dayahead_2024-10-10_EUR.json"
+ROUNDS = 200
+
+
+def dateutil_parse(time_str):
+    """The parser _parse_dt used before."""
+    time = parse_dt(time_str, tzinfos={"Z": timezone("Europe/Stockholm")})
+    if time.tzinfo is None:
+        return timezone("Europe/Stockholm").localize(time).astimezone(utc)
+    return time.astimezone(utc)
+
+
+def main():
+    data = json.loads(PAYLOAD.read_text())
+    stamps = [data["updatedAt"]]
+    for row in data["multiAreaEntries"]:
+        stamps += [row["deliveryStart"], row["deliveryEnd"]]
+
+    assert [dateutil_parse(s) for s in stamps] == [parse_utc(s) for s in stamps]
+
+    results = {}
+    for name, fn in (
+        ("dateutil", dateutil_parse),
+        ("fromisoformat", parse_utc.__wrapped__),
+        ("fromisoformat memoized", parse_utc),
+    ):
+        best = min(
+            timeit.repeat(lambda: [fn(s) for s in stamps], number=ROUNDS, repeat=5)
+        )
+        results[name] = best / ROUNDS / len(stamps) * 1e6
+
+    print(f"{len(stamps)} timestamps from {PAYLOAD.name}")
+    for name, usec in results.items():
+        speedup = results["dateutil"] / usec
+        print(f"{name:>24}: {usec:8.2f} usec/timestamp {speedup:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
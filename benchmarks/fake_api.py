@@ -0,0 +1,81 @@
+"""A local stand in for dataportal-api.nordpoolgroup.com."""
+
+import hashlib
+from collections import Counter
+from datetime import date
+
+from aiohttp import web
+
+from payloads import aggregate, annual, day_ahead
+
+
+class FakeApi:
+    """Serves DayAheadPrices and AggregatePrices and counts the requests.
+
+    Delivery dates in unpublished are answered with 204 like the real
+    api does before the prices are published. Responses has an ETag and
+    a matching If-None-Match is answered with 304.
+    """
+
+    def __init__(self, mtu=60, unpublished=()):
+        self.mtu = mtu
+        self.unpublished = set(unpublished)
+        self.requests = Counter()
+        self.bytes = 0
+        self._runner = None
+        self.url = None
+
+    def reset(self):
+        self.requests.clear()
+        self.bytes = 0
+
+    def _areas(self, request):
+        return request.query["deliveryArea"].split(",")
+
+    def _reply(self, request, payload):
+        self.requests[request.path] += 1
+        resp = web.json_response(payload)
+        etag = '"%s"' % hashlib.sha1(resp.body).hexdigest()
+        if request.headers.get("If-None-Match") == etag:
+            self.requests["304"] += 1
+            return web.Response(status=304, headers={"ETag": etag})
+        resp.headers["ETag"] = etag
+        self.bytes += len(resp.body)
+        return resp
+
+    async def day_ahead(self, request):
+        day = date.fromisoformat(request.query["date"])
+        if day in self.unpublished:
+            self.requests[request.path] += 1
+            return web.Response(status=204)
+        payload = day_ahead(
+            day, self.mtu, self._areas(request), request.query["currency"]
+        )
+        return self._reply(request, payload)
+
+    async def aggregate(self, request):
+        payload = aggregate(
+            int(request.query["year"]), self._areas(request), request.query["currency"]
+        )
+        return self._reply(request, payload)
+
+    async def annual(self, request):
+        payload = annual(int(request.query["year"]), self._areas(request))
+        return self._reply(request, payload)
+
+    async def start(self, host="127.0.0.1", port=0):
+        app = web.Application()
+        app.router.add_get("/api/DayAheadPrices", self.day_ahead)
+        app.router.add_get("/api/AggregatePrices", self.aggregate)
+        app.router.add_get("/api/AggregatePrices/GetAnnuals", self.annual)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}/api/%s"
+        return self.url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
@@ -0,0 +1,173 @@
+"""Responses in the shape of the Nord Pool data portal api.
+
+The prices are made up but deterministic, the timestamps follows the CET
+delivery day so dst days has 23 or 25 hours.
+"""
+
+import json
+import math
+import pathlib
+import random
+from datetime import date, datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+DATA = pathlib.Path(__file__).parent / "data"
+CET = ZoneInfo("Europe/Stockholm")
+
+AREAS = [
+    "EE", "LT", "LV", "AT", "BE", "FR", "GER", "NL", "PL", "DK1", "DK2",
+    "FI", "NO1", "NO2", "NO3", "NO4", "NO5", "SE1", "SE2", "SE3", "SE4", "SYS",
+]  # fmt: skip
+
+# Days worth benchmarking, name -> (delivery date, mtu in minutes)
+DAYS = {
+    "60min": (date(2024, 10, 10), 60),
+    "15min": (date(2025, 10, 10), 15),
+    "dst_spring": (date(2025, 3, 30), 15),
+    "dst_autumn": (date(2025, 10, 26), 15),
+}
+
+
+def _iso(dt):
+    return dt.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _price(rnd, when):
+    base = 60 + 40 * math.sin((when.hour + when.minute / 60) / 24 * 2 * math.pi - 1.8)
+    return round(base + rnd.uniform(-15, 15), 2)
+
+
+def day_ahead(delivery_date, mtu=60, areas=AREAS, currency="EUR"):
+    """A DayAheadPrices response for the delivery date."""
+    rnd = random.Random(f"{delivery_date}{currency}")
+    start = datetime.combine(delivery_date, time(), CET)
+    end = datetime.combine(delivery_date + timedelta(days=1), time(), CET)
+    start, end = start.astimezone(timezone.utc), end.astimezone(timezone.utc)
+
+    rows = []
+    slot = start
+    while slot < end:
+        rows.append(
+            {
+                "deliveryStart": _iso(slot),
+                "deliveryEnd": _iso(slot + timedelta(minutes=mtu)),
+                "entryPerArea": {a: _price(rnd, slot.astimezone(CET)) for a in areas},
+            }
+        )
+        slot += timedelta(minutes=mtu)
+
+    def block(name, first, last):
+        part = rows[first:last]
+        return {
+            "blockName": name,
+            "deliveryStart": part[0]["deliveryStart"],
+            "deliveryEnd": part[-1]["deliveryEnd"],
+            "averagePricePerArea": {
+                a: {
+                    "average": round(
+                        sum(r["entryPerArea"][a] for r in part) / len(part), 2
+                    ),
+                    "min": min(r["entryPerArea"][a] for r in part),
+                    "max": max(r["entryPerArea"][a] for r in part),
+                }
+                for a in areas
+            },
+        }
+
+    per_hour = 60 // mtu
+    return {
+        "deliveryDateCET": delivery_date.isoformat(),
+        "version": 2,
+        "updatedAt": _iso(start - timedelta(hours=11)),
+        "deliveryAreas": list(areas),
+        "market": "DayAhead",
+        "multiAreaEntries": rows,
+        "blockPriceAggregates": [
+            block("Off-peak 1", 0, 8 * per_hour),
+            block("Peak", 8 * per_hour, 20 * per_hour),
+            block("Off-peak 2", 20 * per_hour, len(rows)),
+        ],
+        "currency": currency,
+        "exchangeRate": 1,
+        "areaStates": [{"state": "Final", "areas": list(areas)}],
+        "areaAverages": [
+            {
+                "areaCode": a,
+                "price": round(sum(r["entryPerArea"][a] for r in rows) / len(rows), 2),
+            }
+            for a in areas
+        ],
+    }
+
+
+def _periods(year, kind):
+    first = date(year, 1, 1)
+    if kind == "daily":
+        days = (date(year + 1, 1, 1) - first).days
+        return [
+            (first + timedelta(days=i), first + timedelta(days=i + 1))
+            for i in range(days)
+        ]
+    if kind == "weekly":
+        monday = first - timedelta(days=first.weekday())
+        return [
+            (monday + timedelta(weeks=i), monday + timedelta(weeks=i + 1))
+            for i in range(53)
+            if monday + timedelta(weeks=i) < date(year + 1, 1, 1)
+        ]
+    if kind == "monthly":
+        months = [date(year, m, 1) for m in range(1, 13)] + [date(year + 1, 1, 1)]
+        return list(zip(months, months[1:]))
+    return [(first, date(year + 1, 1, 1))]
+
+
+def _aggregate_rows(rnd, year, kind, areas):
+    return [
+        {
+            "deliveryStart": _iso(datetime.combine(start, time(), CET)),
+            "deliveryEnd": _iso(datetime.combine(end, time(), CET)),
+            "averagePerArea": {a: round(rnd.uniform(10, 120), 2) for a in areas},
+        }
+        for start, end in _periods(year, kind)
+    ]
+
+
+def aggregate(year, areas=AREAS, currency="EUR"):
+    """An AggregatePrices response, it has the daily, weekly and monthly averages."""
+    rnd = random.Random(f"{year}{currency}")
+    return {
+        "currency": currency,
+        "market": "DayAhead",
+        "updatedAt": _iso(datetime.combine(date(year, 1, 1), time(), CET)),
+        "multiAreaDailyAggregates": _aggregate_rows(rnd, year, "daily", areas),
+        "multiAreaWeeklyAggregates": _aggregate_rows(rnd, year, "weekly", areas),
+        "multiAreaMonthlyAggregates": _aggregate_rows(rnd, year, "monthly", areas),
+    }
+
+
+def annual(year, areas=AREAS):
+    """An AggregatePrices/GetAnnuals response.
+    The annual endpoint doesn't say what currency it is in.
+    """
+    rnd = random.Random(f"{year}")
+    return {
+        "market": "DayAhead",
+        "updatedAt": _iso(datetime.combine(date(year, 1, 1), time(), CET)),
+        "prices": _aggregate_rows(rnd, year, "yearly", areas),
+    }
+
+
+def write_all():
+    """Write every payload to benchmarks/data."""
+    DATA.mkdir(exist_ok=True)
+    for name, (day, mtu) in DAYS.items():
+        path = DATA / f"dayahead_{name}_{day}.json"
+        path.write_text(json.dumps(day_ahead(day, mtu), separators=(",", ":")))
+    path = DATA / "aggregate_2024.json"
+    path.write_text(json.dumps(aggregate(2024), separators=(",", ":")))
+    path = DATA / "annual_2024.json"
+    path.write_text(json.dumps(annual(2024), separators=(",", ":")))
+
+
+if __name__ == "__main__":
+    write_all()
@@ -0,0 +1,240 @@
+"""Benchmarks for the hot paths, parse, join, sensor render and a full refresh.
+
+Run from the root of the repo:
+    PYTHONPATH=custom_components python benchmarks/run.py
+
+For every stage it reports the latency per call, the peak traced memory
+and the number of blocks allocated during one call, and for the refresh
+the number of requests and bytes the fake api served. The results of the
+stages are checked before they are timed.
+"""
+
+import argparse
+import asyncio
+import math
+import statistics
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime
+
+from homeassistant.core import HomeAssistant
+from homeassistant.util import dt as dt_utils
+
+from nordpool import NordpoolData
+from nordpool.aio_price import AioPrices, join_result_for_correct_time
+from nordpool.const import tzs
+from nordpool.sensor import NordpoolSensor
+from nordpool.series import PEAK_WINDOWS
+
+from fake_api import FakeApi
+from payloads import DAYS, day_ahead
+
+AREAS = ["SE3", "SE4", "NO1", "FI", "DK1"]
+TEMPLATE = (
+    "{% if now().hour >= 6 and now().hour < 23 %}{{ 0.5 + current_price * 0.25 }}"
+    "{% else %}{{ 0.2 + current_price * 0.25 }}{% endif %}"
+)
+
+
+async def measure(fn, rounds):
+    """Returns (latencies in ms, peak KiB, blocks allocated) for the coroutine fn."""
+    await fn()
+    latencies = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        await fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    await fn()
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    blocks = sum(
+        stat.count_diff
+        for stat in after.compare_to(before, "lineno")
+        if stat.count_diff > 0
+    )
+    return latencies, peak / 1024, blocks
+
+
+def report(name, latencies, peak, blocks, extra=""):
+    ordered = sorted(latencies)
+    p95 = ordered[int(len(ordered) * 0.95) - 1] if len(ordered) > 1 else ordered[0]
+    print(
+        f"{name:<28} {statistics.mean(latencies):9.3f} {p95:9.3f} "
+        f"{peak:10.1f} {blocks:8d} {extra}"
+    )
+
+
+async def check_peak_windows(hass):
+    """The peak windows are in the local time of the area, whatever
+    timezone HA has.
+    """
+    for time_zone in ("Europe/Stockholm", "UTC"):
+        await hass.config.async_set_time_zone(time_zone)
+        api = NordpoolData(hass)
+        api.currency.append("EUR")
+        api.areas += AREAS
+        await api.update_today()
+        for area in AREAS:
+            sensor = NordpoolSensor(
+                "", area, "kWh", 3, 1.0, "EUR", True, False, api, TEMPLATE, hass
+            )
+            sensor.hass = hass
+            sensor._ad_template.hass = hass
+            sensor._data_today = api._data["EUR"]["today"][area]
+            sensor._update()
+
+            tz = dt_utils.get_time_zone(tzs[area])
+            for key, (start, end) in PEAK_WINDOWS.items():
+                values = [
+                    i["value"]
+                    for i in sensor.raw_today
+                    if start <= i["start"].astimezone(tz).hour < end
+                ]
+                expected = statistics.mean(values)
+                actual = getattr(sensor, f"_{key}")
+                assert math.isclose(actual, expected), (time_zone, area, key)
+    await hass.config.async_set_time_zone("Europe/Stockholm")
+
+
+async def check_dst_days():
+    """The local day has 23 or 25 hours on the dst days, in order."""
+    spot = AioPrices("EUR", None)
+    stockholm = dt_utils.get_time_zone("Europe/Stockholm")
+    for day, hours in ((date(2025, 3, 30), 23), (date(2025, 10, 26), 25)):
+        noon = datetime.combine(day, datetime.min.time()).replace(
+            hour=12, tzinfo=stockholm
+        )
+        for mtu in (60, 15):
+            parsed = spot._parse_json(day_ahead(day, mtu), ["SE3"], spot.HOURLY)
+            joined = await join_result_for_correct_time([parsed], noon)
+            starts = [start for start, _, _ in joined["areas"]["SE3"]["values"].rows()]
+            assert len(starts) == hours * 60 // mtu, (day, mtu, len(starts))
+            assert starts == sorted(set(starts)), (day, mtu)
+
+
+async def bench_parse_and_join(rounds):
+    spot = AioPrices("EUR", None)
+    for name, (day, mtu) in DAYS.items():
+        payload = day_ahead(day, mtu)
+
+        async def parse():
+            return spot._parse_json(payload, AREAS, spot.HOURLY)
+
+        report(f"parse {name}", *await measure(parse, rounds))
+
+        parsed = spot._parse_json(payload, AREAS, spot.HOURLY)
+        noon = datetime.combine(day, datetime.min.time()).replace(
+            hour=12, tzinfo=dt_utils.get_time_zone("Europe/Stockholm")
+        )
+
+        async def join():
+            return await join_result_for_correct_time([parsed], noon)
+
+        report(f"join {name}", *await measure(join, rounds))
+
+
+async def bench_sensor(hass, fake, rounds):
+    api = NordpoolData(hass)
+    api.currency.append("SEK")
+    api.areas += AREAS
+    await api.update_today()
+    await api.update_tomorrow()
+
+    sensor = NordpoolSensor(
+        "", "SE3", "kWh", 3, 1.0, "SEK", True, False, api, TEMPLATE, hass
+    )
+    sensor.hass = hass
+    sensor._ad_template.hass = hass
+    sensor._data_today = api._data["SEK"]["today"]["SE3"]
+    sensor._data_tomorrow = api._data["SEK"].get("tomorrow", {}).get("SE3")
+
+    async def compute():
+        sensor._computed.clear()
+        sensor._refresh_series(force=True)
+        sensor._update()
+        return sensor.extra_state_attributes
+
+    async def attributes():
+        return sensor.extra_state_attributes
+
+    report(f"sensor compute {fake.mtu}min", *await measure(compute, rounds))
+    report(f"sensor attributes {fake.mtu}min", *await measure(attributes, rounds))
+
+    # Same area and costs, only the cents and the rounding differs.
+    sensors = [
+        NordpoolSensor(
+            "", "SE3", "kWh", precision, 1.0, "SEK", True, cents, api, TEMPLATE, hass
+        )
+        for precision in (2, 3, 4)
+        for cents in (False, True)
+    ]
+    for other in sensors:
+        other.hass = hass
+        other._data_today = sensor._data_today
+        other._data_tomorrow = sensor._data_tomorrow
+
+    async def shared():
+        sensors[0]._computed.clear()
+        for other in sensors:
+            other._series.clear()
+            other._refresh_series(force=True)
+            other._update()
+
+    report(f"6 sensors compute {fake.mtu}min", *await measure(shared, rounds))
+
+
+async def bench_refresh(hass, fake, rounds):
+    async def refresh():
+        api = NordpoolData(hass)
+        api.currency += ["SEK", "EUR", "NOK", "DKK"]
+        api.areas += AREAS
+        await api.update_today()
+        await api.update_tomorrow()
+
+    latencies, peak, blocks = await measure(refresh, rounds)
+    fake.reset()
+    await refresh()
+    requests = sum(fake.requests.values())
+    report(
+        f"refresh 4 currencies {fake.mtu}min",
+        latencies,
+        peak,
+        blocks,
+        f"{requests} requests {fake.bytes / 1024:.0f} KiB",
+    )
+
+
+async def main(rounds):
+    with tempfile.TemporaryDirectory() as config_dir:
+        hass = HomeAssistant(config_dir)
+        await hass.config.async_set_time_zone("Europe/Stockholm")
+
+        print(
+            f"{'stage':<28} {'mean ms':>9} {'p95 ms':>9} {'peak KiB':>10} {'blocks':>8}"
+        )
+        await check_dst_days()
+        await bench_parse_and_join(rounds)
+
+        for mtu in (60, 15):
+            fake = FakeApi(mtu=mtu)
+            AioPrices.API_URL = await fake.start()
+            try:
+                await check_peak_windows(hass)
+                await bench_sensor(hass, fake, rounds)
+                await bench_refresh(hass, fake, max(rounds // 10, 3))
+            finally:
+                await fake.stop()
+
+        await hass.async_stop(force=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rounds", type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(main(args.rounds))
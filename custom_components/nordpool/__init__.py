@@ -1,21 +1,34 @@
+import asyncio
 import logging
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
+from functools import partial
 
 
-import backoff
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.core import HomeAssistant
-from homeassistant.const import Platform
+from homeassistant.const import EVENT_HOMEASSISTANT_CLOSE, Platform
 from homeassistant.helpers.aiohttp_client import async_get_clientsession
 from homeassistant.helpers.dispatcher import async_dispatcher_send
 from homeassistant.helpers.event import async_track_time_change
 from homeassistant.helpers.typing import ConfigType
 from homeassistant.util import dt as dt_utils
 
-from .aio_price import AioPrices, InvalidValueException
+from .aio_price import (
+    AioPrices,
+    InvalidValueException,
+    delivery_dates,
+)
+from .cache import PriceCache
+from .client import PriceClient
+from .computed import ComputedPrices
 from .events import async_track_time_change_in_tz
+from .history import PriceHistory
+from .metrics import metrics
+from .poller import PublicationPoller
 from .services import async_setup_services
+from .zones import async_load_zones
 
 from .const import (
     NAME,
@@ -24,13 +37,15 @@ from .const import (
     DOMAIN,
     EVENT_NEW_DAY,
     EVENT_NEW_HOUR,
-    EVENT_NEW_PRICE,
     _CURRENCY_LIST,
-    RANDOM_MINUTE,
+    MARKET_TZ,
+    EXECUTOR_WORKERS,
+    MAX_CONCURRENT_FETCHES,
+    POLL_START_MINUTE,
+    PUBLISH_HOUR,
     RANDOM_SECOND,
 )
 
-
 STARTUP = f"""
 -------------------------------------------------------------------
 {NAME}
@@ -49,44 +64,183 @@ PLATFORMS: list[Platform] = [Platform.SENSOR]
 class NordpoolData:
     """Holds the data"""
 
-    def __init__(self, hass: HomeAssistant):
+    def __init__(self, hass: HomeAssistant, max_concurrency=MAX_CONCURRENT_FETCHES):
         self._hass = hass
+        self.max_concurrency = max_concurrency
         self._last_tick = None
+        # The views of the store the sensors read, by currency and today/tomorrow.
         self._data = defaultdict(dict)
+        # Parsed delivery dates by currency and date, with the areas they has.
+        self._days = defaultdict(dict)
+        # (currency, type_) views that had all their delivery dates.
+        self._complete = set()
         self.currency = []
         self.listeners = []
         self.areas = []
-
-    async def _update(self, type_="today", dt=None, areas=None):
-        _LOGGER.debug("calling _update %s %s %s", type_, dt, areas)
-        hass = self._hass
-        client = async_get_clientsession(hass)
+        self.cache = None
+        self.client = None
+        self.history = None
+        self.poller = None
+        # Dedicated pool for the parsing, None is the default executor.
+        self.executor = None
+        # Running fetches by (currency, day) and the areas they cover.
+        self._inflight = {}
+        # (currency, area) that has been fetched for the first time.
+        self._primed = set()
+        # If the sensors should be told when the running fetches are done.
+        self._new_data = False
+        # Computed prices by (area, currency, vat, price_type, template).
+        self._computed = {}
+        # The price sensors by entity id.
+        self.sensors = {}
+        # If the diagnostic sensors has been made.
+        self.diagnostics_added = False
+
+    @metrics.timed("refresh")
+    async def _update(self, type_="today", dt=None, areas=None, currencies=None):
+        _LOGGER.debug("calling _update %s %s %s %s", type_, dt, areas, currencies)
+        if self.client is None:
+            self.client = PriceClient(async_get_clientsession(self._hass))
+        client = self.client
 
         if dt is None:
             dt = dt_utils.now()
 
         if areas is not None:
             self.areas += [area for area in areas if area not in self.areas]
-        # We dont really need today and morrow
-        # when the region is in another timezone
-        # as we request data for 3 days anyway.
-        # Keeping this for now, but this should be changed.
-        for currency in self.currency:
-            spot = AioPrices(currency, client)
-            data = await spot.hourly(
-                end_date=dt, areas=self.areas if len(self.areas) > 0 else None
+        currencies = list(currencies or self.currency)
+        limit = asyncio.Semaphore(self.max_concurrency)
+
+        # Every delivery date is only fetched and parsed once, today and
+        # tomorrow are joined from the dates in the store.
+        async def fetch(currency):
+            areas = list(self.areas)
+            days = self._days[currency]
+            dates = await delivery_dates(dt, areas)
+            missing = [
+                d for d in dates if d not in days or not set(areas) <= days[d][0]
+            ]
+            spot = AioPrices(
+                currency,
+                client,
+                cache=self.cache,
+                history=self.history,
+                executor=self.executor,
             )
+            raw = {}
+            if missing:
+                async with limit:
+                    raw = await spot.raw_days(missing, areas, exact=False)
+            known = {d: parsed for d, (_, parsed) in days.items()}
+            return spot, raw, areas, dates, known
+
+        fetched = await asyncio.gather(
+            *[fetch(currency) for currency in currencies], return_exceptions=True
+        )
+
+        # Parse, join and the local time slots of every currency in one
+        # executor job, so the event loop doesn't do any per slot work.
+        results = await asyncio.get_running_loop().run_in_executor(
+            self.executor,
+            partial(self._parse_all, fetched, dt, dt_utils.DEFAULT_TIME_ZONE),
+        )
+
+        # Keep what we got, one currency failing shouldn't throw away the others.
+        errors = []
+        for currency, job, res in zip(currencies, fetched, results):
+            if isinstance(res, BaseException):
+                _LOGGER.debug("Failed to update %s %s: %r", type_, currency, res)
+                errors.append(res)
+                continue
+
+            _, _, areas, dates, _ = job
+            new, data = res
+            days = self._days[currency]
+            for day, parsed in new.items():
+                # Dont keep days with missing values, they are fetched again.
+                if self._is_complete(parsed):
+                    days[day] = (frozenset(areas), parsed)
+
             if data:
                 self._data[currency][type_] = data["areas"]
+            if all(d in days for d in dates):
+                self._complete.add((currency, type_))
+            else:
+                self._complete.discard((currency, type_))
+
+        if errors:
+            raise errors[0]
+
+    @staticmethod
+    def _parse_all(jobs, dt, tz) -> list:
+        """parse_and_join for every (spot, raw, areas, dates, known), for the
+        executor. A currency that failed to fetch or parse is returned as the
+        exception.
+        """
+        res = []
+        for job in jobs:
+            if isinstance(job, BaseException):
+                res.append(job)
+                continue
+            spot, raw, areas, dates, known = job
+            try:
+                res.append(spot.parse_and_join(raw, areas, dt, dates, known, tz))
+            except Exception as err:
+                res.append(err)
+        return res
+
+    def has_complete(self, type_, currency=None) -> bool:
+        """If every currency, or only currency, has all the delivery dates
+        for today or tomorrow.
+        """
+        currencies = self.currency if currency is None else [currency]
+        return bool(currencies) and all(
+            (currency, type_) in self._complete for currency in currencies
+        )
 
-    async def update_today(self, areas=None):
+    @staticmethod
+    def _is_complete(parsed) -> bool:
+        """Check that every area has a valid value for every row."""
+        return not any(
+            area["values"].has_invalid() for area in parsed["areas"].values()
+        )
+
+    async def rollover(self):
+        """Make tomorrow today. This is just a shift of the views
+        unless tomorrow was missing some of its dates.
+        """
+        oldest = dt_utils.now().date() - timedelta(days=1)
+        for days in self._days.values():
+            for day in [d for d in days if d < oldest]:
+                days.pop(day)
+
+        rebuild = []
+        for currency in self.currency:
+            views = self._data[currency]
+            if (currency, "tomorrow") in self._complete:
+                views["today"] = views.get("tomorrow", {})
+                self._complete.add((currency, "today"))
+            else:
+                rebuild.append(currency)
+            views["tomorrow"] = {}
+            self._complete.discard((currency, "tomorrow"))
+
+        if rebuild:
+            # Only the missing delivery dates are fetched.
+            await self.update_today(currencies=rebuild)
+
+    async def update_today(self, areas=None, currencies=None):
         """Update today's prices"""
         _LOGGER.debug("Updating today's prices.")
         if areas is not None:
             self.areas += [area for area in areas if area not in self.areas]
-        await self._update("today", areas=self.areas if len(self.areas) > 0 else None)
+        await self._update(
+            "today",
+            areas=self.areas if len(self.areas) > 0 else None,
+            currencies=currencies,
+        )
 
-    async def update_tomorrow(self, areas=None):
+    async def update_tomorrow(self, areas=None, currencies=None):
         """Update tomorrows prices."""
         _LOGGER.debug("Updating tomorrows prices.")
         if areas is not None:
@@ -95,8 +249,47 @@ class NordpoolData:
             type_="tomorrow",
             dt=dt_utils.now() + timedelta(hours=24),
             areas=self.areas if len(self.areas) > 0 else None,
+            currencies=currencies,
         )
 
+    def _single_flight(self, currency: str, day: str):
+        """Returns the running fetch for currency and day, and if it was started now.
+
+        A new fetch is chained after the running one if that one
+        doesn't cover all the areas we know about.
+        """
+        key = (currency, day)
+        areas = frozenset(self.areas)
+        running = self._inflight.get(key)
+        if running is not None and areas <= running[0]:
+            return running[1], False
+
+        update = self.update_today if day == "today" else self.update_tomorrow
+        previous = running[1] if running is not None else None
+
+        async def fetch():
+            if previous is not None:
+                await asyncio.wait([previous])
+            try:
+                await update(currencies=[currency])
+            except InvalidValueException:
+                _LOGGER.debug("No data available for %s, retrying later", day)
+
+        task = self._hass.async_create_task(fetch())
+        self._inflight[key] = (areas, task)
+
+        def done(_):
+            if self._inflight.get(key, (None, None))[1] is task:
+                self._inflight.pop(key)
+            if self._new_data and not self._inflight:
+                # Send a new data request once every first fetch is done,
+                # this way all the sensors update with one dispatch.
+                self._new_data = False
+                async_dispatcher_send(self._hass, EVENT_NEW_HOUR)
+
+        task.add_done_callback(done)
+        return task, True
+
     async def _someday(self, area: str, currency: str, day: str):
         """Returns today's or tomorrow's prices in an area in the currency"""
         if currency not in _CURRENCY_LIST:
@@ -111,18 +304,17 @@ class NordpoolData:
         # set in the sensor.
         if currency not in self.currency:
             self.currency.append(currency)
-            try:
-                await self.update_today(areas=self.areas)
-            except InvalidValueException:
-                _LOGGER.debug("No data available for today, retrying later")
-            try:
-                await self.update_tomorrow(areas=self.areas)
-            except InvalidValueException:
-                _LOGGER.debug("No data available for tomorrow, retrying later")
 
-            # Send a new data request after new data is updated for this first run
-            # This way if the user has multiple sensors they will all update
-            async_dispatcher_send(self._hass, EVENT_NEW_HOUR)
+        if (currency, area) not in self._primed:
+            # Every sensor asks at the same time on startup, so the
+            # first one starts the fetch and the rest wait for it.
+            self._primed.add((currency, area))
+            flights = [self._single_flight(currency, d) for d in ("today", "tomorrow")]
+            if any(started for _, started in flights):
+                self._new_data = True
+            await asyncio.gather(*[asyncio.shield(task) for task, _ in flights])
+        elif (currency, day) in self._inflight:
+            await asyncio.shield(self._inflight[(currency, day)][1])
 
         return self._data.get(currency, {}).get(day, {}).get(area)
 
@@ -134,25 +326,58 @@ class NordpoolData:
         """Returns tomorrow's prices in an area in the requested currency"""
         return await self._someday(area, currency, "tomorrow")
 
+    def computed_prices(self, area, currency, vat, price_type, template):
+        """The ComputedPrices every sensor with these settings shares."""
+        key = (area, currency, vat, price_type, template.template)
+        computed = self._computed.get(key)
+        if computed is None:
+            computed = self._computed[key] = ComputedPrices(template, price_type, vat)
+        return computed
+
 
 async def _dry_setup(hass: HomeAssistant, config: ConfigType) -> bool:
     """Set up using yaml config file."""
     if DOMAIN not in hass.data:
+        # Every timezone we need, so nothing reads them from disk later.
+        await async_load_zones()
         api = NordpoolData(hass)
         hass.data[DOMAIN] = api
         _LOGGER.debug("Added %s to hass.data", DOMAIN)
-        await async_setup_services(hass)
+        # Load the published prices from disk so a restart doesn't have to
+        # wait for the api before the sensors get a value.
+        api.cache = PriceCache(hass)
+        await api.cache.async_load()
+        # A small pool of our own for the decoding and parsing, so a refresh
+        # doesn't wait behind everything else in the default executor.
+        executor = api.executor = ThreadPoolExecutor(
+            max_workers=EXECUTOR_WORKERS, thread_name_prefix=DOMAIN
+        )
+        # One keep-alive connection pool and response cache for the sensors
+        # and the services.
+        api.client = PriceClient.create(hass, executor)
+        # Every price we have fetched, so it's never downloaded again.
+        api.history = PriceHistory(hass)
+        await api.history.async_load()
+
+        async def shutdown_executor(_):
+            executor.shutdown(wait=False)
+
+        api.listeners.append(
+            hass.bus.async_listen_once(EVENT_HOMEASSISTANT_CLOSE, shutdown_executor)
+        )
+        await async_setup_services(
+            hass, api.client, api.cache, api.history, api.sensors
+        )
 
         async def new_day_cb(_):
             """Cb to handle some house keeping when it a new day."""
             _LOGGER.debug("Called new_day_cb callback")
+            api.cache.prune()
 
-            for curr in api.currency:
-                if not api._data.get(curr, {}).get("tomorrow"):
-                    api._data[curr]["today"] = await api.update_today()
-                else:
-                    api._data[curr]["today"] = api._data[curr]["tomorrow"]
-                api._data[curr]["tomorrow"] = {}
+            try:
+                await api.rollover()
+            except InvalidValueException:
+                _LOGGER.debug("No data available for today, retrying later")
 
             async_dispatcher_send(hass, EVENT_NEW_DAY)
 
@@ -161,39 +386,30 @@ async def _dry_setup(hass: HomeAssistant, config: ConfigType) -> bool:
             _LOGGER.debug("Called new_hr callback")
             async_dispatcher_send(hass, EVENT_NEW_HOUR)
 
-        @backoff.on_exception(
-            backoff.constant,
-            (InvalidValueException),
-            logger=_LOGGER,
-            interval=600,
-            max_time=7200,
-            jitter=None,
-        )
-        async def new_data_cb(_):
-            """Callback to fetch new data for tomorrows prices at 1300ish CET
-            and notify any sensors, about the new data
-            """
-            # _LOGGER.debug("Called new_data_cb")
-            await api.update_tomorrow()
-            async_dispatcher_send(hass, EVENT_NEW_PRICE)
-
         # Handles futures updates
+        poller = api.poller = PublicationPoller(hass, api)
         cb_update_tomorrow = async_track_time_change_in_tz(
             hass,
-            new_data_cb,
-            hour=13,
-            minute=RANDOM_MINUTE,
+            poller.start,
+            hour=PUBLISH_HOUR,
+            minute=POLL_START_MINUTE,
             second=RANDOM_SECOND,
-            tz=await dt_utils.async_get_time_zone("Europe/Stockholm"),
+            tz=await dt_utils.async_get_time_zone(MARKET_TZ),
         )
+        if poller.in_window():
+            # Started while we should be polling.
+            hass.async_create_task(poller.start())
 
         cb_new_day = async_track_time_change(
             hass, new_day_cb, hour=0, minute=0, second=0
         )
 
-        cb_new_hr = async_track_time_change(hass, new_hr, minute=[0, 15, 30, 45], second=0)
+        cb_new_hr = async_track_time_change(
+            hass, new_hr, minute=[0, 15, 30, 45], second=0
+        )
 
         api.listeners.append(cb_update_tomorrow)
+        api.listeners.append(poller.stop)
         api.listeners.append(cb_new_hr)
         api.listeners.append(cb_new_day)
 
@@ -225,6 +441,12 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
         if DOMAIN in hass.data:
             for unsub in hass.data[DOMAIN].listeners:
                 unsub()
+            if hass.data[DOMAIN].client is not None:
+                await hass.data[DOMAIN].client.close()
+            if hass.data[DOMAIN].history is not None:
+                await hass.data[DOMAIN].history.async_close()
+            if hass.data[DOMAIN].executor is not None:
+                hass.data[DOMAIN].executor.shutdown(wait=False)
         hass.data.pop(DOMAIN)
 
         return True
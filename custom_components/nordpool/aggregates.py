@@ -0,0 +1,157 @@
+import math
+from datetime import date, datetime, time, timedelta, timezone
+
+from homeassistant.util import dt as dt_utils
+
+from .const import MARKET_TZ
+from .series import PriceSeries
+from .zones import day_bounds
+
+__all__ = ["periods", "group_average", "async_local_aggregates"]
+
+# Response key for every kind of period, like the AggregatePrices endpoints.
+AGGREGATE_KEYS = {
+    "daily": "multiAreaDailyAggregates",
+    "weekly": "multiAreaWeeklyAggregates",
+    "monthly": "multiAreaMonthlyAggregates",
+    "yearly": "prices",
+}
+
+
+def periods(kind, year) -> list:
+    """[start, end) delivery dates of every period in the year.
+    Weeks starts on monday, the first and last week are cut at the year.
+    """
+    first, last = date(year, 1, 1), date(year + 1, 1, 1)
+    if kind == "daily":
+        days = [first + timedelta(days=i) for i in range((last - first).days + 1)]
+        return list(zip(days, days[1:]))
+    if kind == "weekly":
+        monday = first - timedelta(days=first.weekday())
+        res = []
+        while monday < last:
+            res.append((max(monday, first), min(monday + timedelta(weeks=1), last)))
+            monday += timedelta(weeks=1)
+        return res
+    if kind == "monthly":
+        months = [date(year, m, 1) for m in range(1, 13)] + [last]
+        return list(zip(months, months[1:]))
+    return [(first, last)]
+
+
+def group_average(series: PriceSeries, bounds) -> list:
+    """Average price for every [start, end) in epoch seconds, None for no prices.
+
+    Every group is a slice of the packed array, the slots has a fixed
+    length so an average over the slots is the time weighted average.
+    """
+    res = []
+    for start, end in bounds:
+        values = [v for v in series.between(start, end).values if not math.isnan(v)]
+        res.append(math.fsum(values) / len(values) if values else None)
+    return res
+
+
+def _iso(dt) -> str:
+    return dt.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _by_bounds(rows) -> tuple:
+    """The rows of an api response by their start and by their end, epoch
+    seconds. The api doesn't cut the first and last week at the year, so
+    they are only found by the end and the start.
+    """
+    by_start, by_end = {}, {}
+    for row in rows:
+        by_start[dt_utils.parse_datetime(row["deliveryStart"]).timestamp()] = row
+        by_end[dt_utils.parse_datetime(row["deliveryEnd"]).timestamp()] = row
+    return by_start, by_end
+
+
+async def async_local_aggregates(
+    history, currency, year, areas, kinds, price=None, fallback=None
+):
+    """The averages for kinds of periods from the price history.
+
+    Only the periods that has started is included. The periods the history
+    is missing a delivery date in are taken from fallback, an async function
+    that returns the api response for the kinds, with price applied to them.
+    Returns None if there is no fallback for them, or if none of the periods
+    are in the history and there is no price, the api response is better then.
+    price is an optional function that gets a PriceSeries and returns it
+    with the prices in another basis, like with VAT.
+    """
+    market = await dt_utils.async_get_time_zone(MARKET_TZ)
+    today = dt_utils.now().astimezone(market).date()
+    wanted = {kind: [p for p in periods(kind, year) if p[0] <= today] for kind in kinds}
+    if not any(wanted.values()):
+        return None
+
+    first = min(p[0][0] for p in wanted.values() if p)
+    last = max(p[-1][1] for p in wanted.values() if p)
+    last = min(last, today + timedelta(days=1))
+    # Tomorrow is used if we have it.
+    if last == today + timedelta(days=1) and history.has(currency, last, areas):
+        last += timedelta(days=1)
+    stored = set()
+    day = first
+    while day < last:
+        if history.has(currency, day, areas):
+            stored.add(day)
+        day += timedelta(days=1)
+
+    def in_history(start, end):
+        days = (min(end, last) - start).days
+        return all(start + timedelta(days=i) in stored for i in range(days))
+
+    local = {kind: [in_history(*period) for period in p] for kind, p in wanted.items()}
+    if not any(any(i) for i in local.values()) and price is None:
+        return None
+    missing = not all(all(i) for i in local.values())
+    if missing and fallback is None:
+        return None
+
+    def epoch(day):
+        return day_bounds(None, day)[0]
+
+    rows = {kind: [{} for _ in p] for kind, p in wanted.items()}
+    # Nothing to read when only the api has the periods.
+    for area in areas if stored else []:
+        series = await history.async_series(area, currency, epoch(first), epoch(last))
+        if price is not None:
+            series = price(series)
+        for kind, p in wanted.items():
+            averages = group_average(
+                series, [(epoch(start), epoch(min(end, last))) for start, end in p]
+            )
+            for per_area, average, ok in zip(rows[kind], averages, local[kind]):
+                if ok:
+                    per_area[area] = average
+
+    if missing:
+        api = await fallback() or {}
+        for kind, p in wanted.items():
+            by_start, by_end = _by_bounds(api.get(AGGREGATE_KEYS[kind], []))
+            for (start, end), per_area, ok in zip(p, rows[kind], local[kind]):
+                if ok:
+                    continue
+                start, end = epoch(start), epoch(end)
+                row = by_start.get(start) or by_end.get(end)
+                for area in areas:
+                    value = (row or {}).get("averagePerArea", {}).get(area)
+                    if value is not None and price is not None:
+                        value = price(PriceSeries(start, end - start, [value]))
+                        value = value.price_at(start)
+                    per_area[area] = value
+
+    res = {"market": "DayAhead", "updatedAt": _iso(dt_utils.utcnow())}
+    for kind, p in wanted.items():
+        res[AGGREGATE_KEYS[kind]] = [
+            {
+                "deliveryStart": _iso(datetime.combine(start, time(), market)),
+                "deliveryEnd": _iso(datetime.combine(end, time(), market)),
+                "averagePerArea": per_area,
+            }
+            for (start, end), per_area in zip(p, rows[kind])
+        ]
+    return res
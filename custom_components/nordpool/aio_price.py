@@ -3,21 +3,41 @@ import logging
 from collections import defaultdict
 from datetime import date, datetime, timedelta
 from datetime import timezone as ts
+from functools import lru_cache, partial
 
 # import aiohttp
 # import backoff
 from dateutil.parser import parse as parse_dt
-from homeassistant.util import dt as dt_utils
 
 # from nordpool.elspot import Prices
-from pytz import timezone, utc
 
+from .aggregates import async_local_aggregates
+from .cache import PriceCache
+from .client import PriceClient
+from .metrics import metrics
 from .misc import add_junk
-from .const import tzs, INVALID_VALUES
+from .series import PriceSeries
+from .zones import async_load_zones, day_bounds, local_date, market_zone, zone
 
 _LOGGER = logging.getLogger(__name__)
 
 
+@lru_cache(maxsize=2048)
+def parse_utc(time_str):
+    """Parse datetimes to UTC from Stockholm time, which Nord Pool uses.
+
+    The api uses a fixed ISO 8601 format like 2024-10-10T22:00:00Z that
+    fromisoformat handles, dateutil is only used for anything else.
+    """
+    try:
+        parsed = datetime.fromisoformat(time_str)
+    except ValueError:
+        parsed = parse_dt(time_str, tzinfos={"Z": market_zone()})
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=market_zone())
+    return parsed.astimezone(ts.utc)
+
+
 class InvalidValueException(ValueError):
     pass
 
@@ -26,10 +46,47 @@ class CurrencyMismatch(ValueError):  # pylint: disable=missing-class-docstring
     pass
 
 
+async def delivery_dates(dt, areas):
+    """Returns the delivery dates needed to cover the
+    local day of dt in every area, oldest first.
+    """
+    if dt is None:
+        dt = datetime.now(ts.utc)
+
+    await async_load_zones()
+    market = market_zone()
+    dates = set()
+    for area in areas:
+        if zone(area) is None:
+            continue
+
+        # Same day boundaries as join_result_for_correct_time
+        start, end, _ = day_bounds(area, local_date(area, dt))
+        day = datetime.fromtimestamp(start, market).date()
+        last = datetime.fromtimestamp(end - 1, market).date()
+        while day <= last:
+            dates.add(day)
+            day += timedelta(days=1)
+
+    if not dates:
+        # None of the areas has a known timezone, just ask for the day.
+        dates.add(dt.date())
+
+    return sorted(dates)
+
+
 async def join_result_for_correct_time(results, dt):
     """Parse a list of responses from the api
     to extract the correct hours in there timezone.
     """
+    # Load the timezones without blocking, join_days gets them from the table.
+    await async_load_zones()
+    return join_days(results, dt)
+
+
+@metrics.timed("join")
+def join_days(results, dt):
+    """join_result_for_correct_time without the event loop, for the executor."""
     # utc = datetime.utcnow()
     fin = defaultdict(dict)
     # _LOGGER.debug("join_result_for_correct_time %s", dt)
@@ -38,14 +95,17 @@ async def join_result_for_correct_time(results, dt):
     else:
         utc = dt
 
+    # The local day of every area, in epoch seconds.
+    bounds = {}
     for day_ in results:
         for key, value in day_.get("areas", {}).items():
-            zone = tzs.get(key)
-            if zone is None:
+            if zone(key) is None:
                 _LOGGER.debug("Skipping %s", key)
                 continue
-            else:
-                zone = await dt_utils.async_get_time_zone(zone)
+
+            # Dont touch the parsed response, it might be joined again.
+            series = value.get("values", PriceSeries())
+            value = {k: v for k, v in value.items() if k != "values"}
 
             # We add junk here as the peak etc
             # from the api is based on cet, not the
@@ -53,37 +113,24 @@ async def join_result_for_correct_time(results, dt):
             # its later corrected in the sensor.
             value = add_junk(value)
 
-            values = day_["areas"][key].pop("values")
-
             # We need to check this so we dont overwrite stuff.
             if key not in fin["areas"]:
                 fin["areas"][key] = {}
             fin["areas"][key].update(value)
-            if "values" not in fin["areas"][key]:
-                fin["areas"][key]["values"] = []
-
-            start_of_day = utc.astimezone(zone).replace(
-                hour=0, minute=0, second=0, microsecond=0
-            )
-            end_of_day = utc.astimezone(zone).replace(
-                hour=23, minute=59, second=59, microsecond=999999
-            )
+            parts = fin["areas"][key].setdefault("values", [])
+
+            if key not in bounds:
+                bounds[key] = day_bounds(key, local_date(key, utc))
+            start, end, _ = bounds[key]
+            part = series.between(start, end)
+            if part.has_invalid():
+                raise InvalidValueException(
+                    f"Invalid value in {part.as_dicts()} for area '{key}'"
+                )
+            parts.append(part)
 
-            for val in values:
-                local = val["start"].astimezone(zone)
-                local_end = val["end"].astimezone(zone)
-                if start_of_day <= local <= end_of_day:
-                    if local == local_end:
-                        _LOGGER.info(
-                            "Hour has the same start and end, most likly due to dst change %s exluded this hour",
-                            val,
-                        )
-                    elif val["value"] in INVALID_VALUES:
-                        raise InvalidValueException(
-                            f"Invalid value in {val} for area '{key}'"
-                        )
-                    else:
-                        fin["areas"][key]["values"].append(val)
+    for value in fin["areas"].values():
+        value["values"] = PriceSeries.concat(value["values"])
 
     return fin
 
@@ -91,36 +138,45 @@ async def join_result_for_correct_time(results, dt):
 class AioPrices:
     """Interface"""
 
-    def __init__(self, currency, client, timeezone=None):
+    API_URL = "https://dataportal-api.nordpoolgroup.com/api/%s"
+
+    def __init__(
+        self,
+        currency,
+        client,
+        timeezone=None,
+        cache=None,
+        history=None,
+        executor=None,
+    ):
         # super().__init__(currency)
+        if client is not None and not isinstance(client, PriceClient):
+            # A plain aiohttp session.
+            client = PriceClient(client)
         self.client = client
         self.timeezone = timeezone
-        (self.HOURLY, self.DAILY, self.WEEKLY, self.MONTHLY, self.YEARLY) = (
+        self.cache = cache
+        self.history = history
+        # Where the parsing runs, None is the default executor.
+        self.executor = executor
+        self.HOURLY, self.DAILY, self.WEEKLY, self.MONTHLY, self.YEARLY = (
             "DayAheadPrices",
             "AggregatePrices",
             "AggregatePrices",
             "AggregatePrices",
             "AggregatePrices/GetAnnuals",
         )
-        self.API_URL = "https://dataportal-api.nordpoolgroup.com/api/%s"
         self.currency = currency
 
+    @metrics.timed("fetch")
     async def _io(self, url, **kwargs):
-        resp = await self.client.get(url, params=kwargs)
-        _LOGGER.debug("requested %s %s", resp.url, kwargs)
-
-        if resp.status == 204:
-            return None
-
-        return await resp.json()
+        return await self.client.get_json(url, kwargs)
 
     def _parse_dt(self, time_str):
         """Parse datetimes to UTC from Stockholm time, which Nord Pool uses."""
-        time = parse_dt(time_str, tzinfos={"Z": timezone("Europe/Stockholm")})
-        if time.tzinfo is None:
-            return timezone("Europe/Stockholm").localize(time).astimezone(utc)
-        return time.astimezone(utc)
+        return parse_utc(time_str)
 
+    @metrics.timed("parse")
     def _parse_json(self, data, areas=None, data_type=None):
         """
         Parse json response from fetcher.
@@ -130,7 +186,8 @@ class AioPrices:
             - update time
             - currency
             - dictionary of areas, based on selection
-                - list of values (dictionary with start and endtime and value)
+                - list of values (dictionary with start and endtime and value),
+                  a PriceSeries for hourly
                 - possible other values, such as min, max, average for hourly
         """
 
@@ -178,16 +235,22 @@ class AioPrices:
 
         area_data = {}
 
+        wanted = set(areas)
+        hourly = data_source[0] == "multiAreaEntries"
+
         # Loop through response rows
         for r in data[data_source[0]]:
             row_start_time = self._parse_dt(r["deliveryStart"])
             row_end_time = self._parse_dt(r["deliveryEnd"])
-
-            # Loop through columns
-            for area_key in r[data_source[1]].keys():
-                area_price = r[data_source[1]][area_key]
-                # If areas is defined and name isn't in areas, skip column
-                if area_key not in areas:
+            if hourly:
+                # The slots are kept as epoch seconds in a PriceSeries.
+                row_start_time = int(row_start_time.timestamp())
+                row_end_time = int(row_end_time.timestamp())
+            per_area = r[data_source[1]]
+
+            # Only look at the columns we asked for
+            for area_key in wanted:
+                if area_key not in per_area:
                     continue
 
                 # If name isn't in area_data, initialize dictionary
@@ -196,14 +259,24 @@ class AioPrices:
                         "values": [],
                     }
 
-                # Append dictionary to value list
-                area_data[area_key]["values"].append(
-                    {
-                        "start": row_start_time,
-                        "end": row_end_time,
-                        "value": self._conv_to_float(area_price),
-                    }
-                )
+                value = self._conv_to_float(per_area[area_key])
+                if hourly:
+                    area_data[area_key]["values"].append(
+                        (row_start_time, row_end_time, value)
+                    )
+                else:
+                    # Append dictionary to value list
+                    area_data[area_key]["values"].append(
+                        {
+                            "start": row_start_time,
+                            "end": row_end_time,
+                            "value": value,
+                        }
+                    )
+
+        if hourly:
+            for value in area_data.values():
+                value["values"] = PriceSeries.from_rows(sorted(value["values"]))
 
         return {
             "start": start_time,
@@ -213,7 +286,7 @@ class AioPrices:
             "areas": area_data,
         }
 
-    async def _fetch_json(self, data_type, end_date=None, areas=None):
+    async def _fetch_json(self, data_type, end_date=None, areas=None, exact=False):
         """Fetch JSON from API"""
         # If end_date isn't set, default to tomorrow
         if data_type is None:
@@ -241,8 +314,48 @@ class AioPrices:
         if data_type != self.HOURLY:
             kws.pop("date")
             kws["year"] = end_date.strftime("%Y")
+        else:
+            stored = await self._stored(areas, kws["date"], exact)
+            if stored is not None:
+                return stored
+
+        res = await self._io(self.API_URL % data_type, **kws)
+        if data_type == self.HOURLY:
+            if self.cache is not None:
+                self.cache.set(self.currency, areas, kws["date"], res)
+            if self.history is not None:
+                await self.history.async_add_payload(self.currency, kws["date"], res)
 
-        return await self._io(self.API_URL % data_type, **kws)
+        return res
+
+    async def _stored(self, areas, delivery_date, exact):
+        """A DayAheadPrices response we already have or None.
+        With exact it's the raw response for these areas, like the actions
+        returns, from the cache or the history.
+        """
+        metrics.count("stored_lookups")
+        res = await self._stored_payload(areas, delivery_date, exact)
+        if res is None:
+            metrics.count("stored_misses")
+        return res
+
+    async def _stored_payload(self, areas, delivery_date, exact):
+        if self.cache is not None:
+            cached = self.cache.get(self.currency, areas, delivery_date, exact=exact)
+            if cached is not None:
+                if self.history is not None:
+                    await self.history.async_add_payload(
+                        self.currency, delivery_date, cached
+                    )
+                return cached
+
+        if self.history is None:
+            return None
+        if exact:
+            return await self.history.async_raw_payload(
+                self.currency, delivery_date, areas
+            )
+        return await self.history.async_payload(self.currency, delivery_date, areas)
 
     # Add more exceptions as we find them. KeyError is raised when the api return
     # junk due to currency not being available in the data.
@@ -279,41 +392,119 @@ class AioPrices:
         if isinstance(end_date, str):
             end_date = parse_dt(end_date)
 
+        if not isinstance(areas, list):
+            areas = [i.strip() for i in areas.split(",")]
+
         today = end_date
-        yesterday = today - timedelta(days=1)
-        tomorrow = today + timedelta(days=1)
 
         if data_type == self.HOURLY:
             if raw:
-                return await self._fetch_json(data_type, today, areas)
-            jobs = [
-                self._fetch_json(
-                    data_type, yesterday, areas
-                ),  # TODO this is no longer needed, seems like NP api really does return what they should
-                self._fetch_json(data_type, today, areas),
-                self._fetch_json(data_type, tomorrow, areas),
-            ]
+                # The raw response is returned as is,
+                # so it must be for these areas only.
+                return await self._fetch_json(data_type, today, areas, exact=True)
+            # Only ask for the delivery dates that overlaps
+            # the local day in the areas timezone.
+            dates = await delivery_dates(end_date, areas)
+            days = await self.raw_days(dates, areas, exact=False)
+            _, joined = await self.async_parse_and_join(days, areas, end_date, dates)
+            return joined
         else:
             # This is really not today but a year..
+            if self.history is not None:
+                # Computed from the hourly prices if we have all of them.
+                local = await self.aggregates(today.year, areas, data_type)
+                if local is not None:
+                    return local
             # All except from hourly returns the raw values
             return await self._fetch_json(data_type, today, areas)
 
-        res = await asyncio.gather(*jobs)
-        raw = [
-            await self._async_parse_json(i, areas, data_type=data_type)
-            for i in res
-            if i
-        ]
+    async def aggregates(self, year, areas, data_type=None, price=None):
+        """The aggregated prices for the year from the price history, in the
+        same form as the api. The periods the history is missing days in
+        are from the api, None if none of them are in the history and
+        there is no price. price is passed on to async_local_aggregates.
+        """
+        if data_type == self.YEARLY:
+            kinds = ["yearly"]
+        else:
+            data_type = self.DAILY
+            kinds = ["daily", "weekly", "monthly"]
+
+        async def fallback():
+            return await self._fetch_json(data_type, date(int(year), 1, 1), areas)
+
+        res = await async_local_aggregates(
+            self.history,
+            self.currency,
+            int(year),
+            areas,
+            kinds,
+            price=price,
+            fallback=fallback,
+        )
+        if res is not None and data_type != self.YEARLY:
+            res["currency"] = self.currency
+        return res
 
-        return await join_result_for_correct_time(raw, end_date)
+    async def published(self, delivery_date, area) -> bool:
+        """Cheap check if all the prices for the delivery date is out,
+        it only asks for one area and always goes to the api.
+        """
+        kws = {
+            "currency": self.currency,
+            "market": "DayAhead",
+            "deliveryArea": area,
+            "date": delivery_date.strftime("%Y-%m-%d"),
+        }
+        res = await self.client.get_json(
+            self.API_URL % self.HOURLY, kws, revalidate=True
+        )
+        return PriceCache.cacheable(res)
 
-    async def _async_parse_json(self, data, areas, data_type):
+    async def raw_days(self, dates, areas, limit=None, exact=True):
+        """The raw hourly responses for each delivery date, for these areas only
+        unless exact is False. Dates without any data yet is left out. limit
+        is an optional semaphore for how many requests that runs at the same
+        time.
         """
-        Async version of _parse_json to prevent blocking calls inside the event loop.
+        dates = sorted(set(dates))
+
+        async def fetch(day):
+            if limit is None:
+                return await self._fetch_json(self.HOURLY, day, areas, exact=exact)
+            async with limit:
+                return await self._fetch_json(self.HOURLY, day, areas, exact=exact)
+
+        res = await asyncio.gather(*[fetch(day) for day in dates])
+        return {day: i for day, i in zip(dates, res) if i}
+
+    def parse_and_join(self, raw, areas, dt, dates, known=None, tz=None):
+        """Parse the raw delivery dates, join the local day of dt and convert
+        the slots to tz, everything a refresh has to do with dates.
+
+        known has the parsed delivery dates we already have. Returns the new
+        parsed delivery dates and the joined prices.
+        """
+        parsed = {
+            day: self._parse_json(i, areas, data_type=self.HOURLY)
+            for day, i in raw.items()
+            if i
+        }
+        days = {**(known or {}), **parsed}
+        joined = join_days([days[d] for d in dates if d in days], dt)
+        if tz is not None:
+            for value in joined.get("areas", {}).values():
+                value["slots"] = list(value["values"].slots(tz))
+        return parsed, joined
+
+    async def async_parse_and_join(self, raw, areas, dt, dates, known=None, tz=None):
+        """parse_and_join as one job in the executor, so the event loop
+        doesn't do any of the per slot datetime work.
         """
         loop = asyncio.get_running_loop()
         return await loop.run_in_executor(
-            None, self._parse_json, data, areas, data_type
+            self.executor,
+            partial(self.parse_and_join, raw, areas, dt, dates, known, tz),
         )
 
     async def hourly(self, end_date=None, areas=None, raw=False):
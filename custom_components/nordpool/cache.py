@@ -0,0 +1,96 @@
+import logging
+from datetime import date, timedelta
+
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.storage import Store
+
+from .const import (
+    CACHE_KEEP_DAYS,
+    CACHE_SAVE_DELAY,
+    CACHE_STORAGE_KEY,
+    CACHE_STORAGE_VERSION,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class _CacheStore(Store):
+    """Store that throws away caches written by other versions."""
+
+    async def _async_migrate_func(self, old_major_version, old_minor_version, old_data):
+        _LOGGER.debug(
+            "Discarding price cache version %s.%s", old_major_version, old_minor_version
+        )
+        return {}
+
+
+class PriceCache:
+    """On disk cache of the raw DayAheadPrices responses.
+
+    Day-ahead prices never change once they are published so a response is
+    valid forever. The responses are kept per currency and delivery date,
+    together with the areas they were requested for.
+    """
+
+    def __init__(self, hass: HomeAssistant):
+        self._store = _CacheStore(hass, CACHE_STORAGE_VERSION, CACHE_STORAGE_KEY)
+        # {currency: {"YYYY-MM-DD": [{"areas": [..], "payload": {..}}]}}
+        self._data = {}
+
+    async def async_load(self) -> None:
+        """Load the cache from disk."""
+        data = await self._store.async_load()
+        self._data = data or {}
+        self.prune()
+        _LOGGER.debug("Loaded price cache for %s", list(self._data))
+
+    def get(self, currency, areas, delivery_date, exact=False):
+        """Return a cached response covering areas or None."""
+        wanted = set(areas)
+        for entry in self._data.get(currency, {}).get(delivery_date, []):
+            cached = set(entry["areas"])
+            if cached == wanted or (not exact and wanted <= cached):
+                _LOGGER.debug("Cache hit %s %s %s", currency, delivery_date, areas)
+                return entry["payload"]
+        return None
+
+    def set(self, currency, areas, delivery_date, payload) -> None:
+        """Add a published response to the cache. Only the dates the sensors
+        uses are kept, older ones like from a backfill is in the history.
+        """
+        if not self.cacheable(payload) or delivery_date < self._oldest():
+            return
+
+        wanted = set(areas)
+        entries = [
+            entry
+            for entry in self._data.setdefault(currency, {}).get(delivery_date, [])
+            if not set(entry["areas"]) <= wanted
+        ]
+        entries.append({"areas": sorted(wanted), "payload": payload})
+        self._data[currency][delivery_date] = entries
+        self._store.async_delay_save(lambda: self._data, CACHE_SAVE_DELAY)
+
+    @staticmethod
+    def cacheable(payload) -> bool:
+        """Only keep complete responses, missing values might still be published."""
+        if not payload or not payload.get("multiAreaEntries"):
+            return False
+        for row in payload["multiAreaEntries"]:
+            if any(v is None for v in row.get("entryPerArea", {}).values()):
+                return False
+        return True
+
+    @staticmethod
+    def _oldest(keep_days=CACHE_KEEP_DAYS) -> str:
+        return (date.today() - timedelta(days=keep_days)).strftime("%Y-%m-%d")
+
+    def prune(self, keep_days=CACHE_KEEP_DAYS) -> None:
+        """Remove delivery dates we dont need anymore."""
+        oldest = self._oldest(keep_days)
+        for currency in list(self._data):
+            days = self._data[currency]
+            for delivery_date in [d for d in days if d < oldest]:
+                days.pop(delivery_date)
+            if not days:
+                self._data.pop(currency)
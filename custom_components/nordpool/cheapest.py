@@ -0,0 +1,51 @@
+import heapq
+
+__all__ = ["cheapest_window", "cheapest_slots"]
+
+
+def cheapest_window(slots, duration):
+    """The cheapest contiguous window of at least duration seconds as
+    (start, end, average), or None if there isn't one.
+
+    slots is a sorted list of (start, end, price) in epoch seconds where
+    price is None for missing prices. A window is the fewest whole slots
+    that covers duration, so it's rounded up to the slot length. The window
+    is moved one slot at a time with a running sum, so it's O(n) and works
+    with any mix of slot lengths. The average is time weighted.
+    """
+    best = None
+    j = 0
+    # price * seconds for slots[i:j].
+    total = 0.0
+    n = len(slots)
+    for i in range(n):
+        if j < i:
+            j, total = i, 0.0
+        start = slots[i][0]
+        end = start + duration
+        while j < n and (j == i or slots[j - 1][1] < end):
+            slot_start, slot_end, price = slots[j]
+            if price is None or (j > i and slot_start != slots[j - 1][1]):
+                # Missing price or a gap.
+                break
+            total += price * (slot_end - slot_start)
+            j += 1
+
+        if j > i and slots[j - 1][1] >= end:
+            window_end = slots[j - 1][1]
+            average = total / (window_end - start)
+            if best is None or average < best[2]:
+                best = (start, window_end, average)
+
+        if j > i:
+            slot_start, slot_end, price = slots[i]
+            total -= price * (slot_end - slot_start)
+    return best
+
+
+def cheapest_slots(slots, count):
+    """The count cheapest slots sorted by start, they don't have to be next
+    to each other. Missing prices are left out.
+    """
+    valid = [slot for slot in slots if slot[2] is not None]
+    return sorted(heapq.nsmallest(count, valid, key=lambda slot: slot[2]))
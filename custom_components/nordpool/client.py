@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+import aiohttp
+from homeassistant.const import EVENT_HOMEASSISTANT_CLOSE
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.aiohttp_client import SERVER_SOFTWARE
+from homeassistant.util.json import json_loads
+
+from .cache import PriceCache
+from .metrics import metrics
+from .const import (
+    HTTP_CACHE_SIZE,
+    HTTP_CACHE_TTL,
+    HTTP_CACHE_TTL_PUBLISHED,
+    HTTP_KEEPALIVE,
+    HTTP_LIMIT_PER_HOST,
+    HTTP_TIMEOUT,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class _Entry:
+    __slots__ = ("data", "etag", "last_modified", "expires")
+
+    def __init__(self, data, etag, last_modified, expires):
+        self.data = data
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires = expires
+
+
+class PriceClient:
+    """Http client for the Nord Pool api.
+
+    Decoded responses are kept in memory by url and params. A fresh one is
+    returned without asking the api, a stale one is revalidated with
+    ETag/Last-Modified if the api sent them. Requests for the same url and
+    params that are running at the same time are only sent once.
+    """
+
+    def __init__(
+        self, session: aiohttp.ClientSession, owns_session=False, executor=None
+    ):
+        self._session = session
+        self._owns_session = owns_session
+        # Where the decoding runs, None is the default executor.
+        self.executor = executor
+        self._timeout = aiohttp.ClientTimeout(total=HTTP_TIMEOUT)
+        self._entries = OrderedDict()
+        self._pending = {}
+        self.hits = 0
+        self.requests = 0
+        self.not_modified = 0
+        self._unsub_close = None
+
+    @classmethod
+    def create(cls, hass: HomeAssistant, executor=None) -> "PriceClient":
+        """A client with its own keep-alive connection pool for the api,
+        it's closed when hass stops or when close is called.
+        """
+        connector = aiohttp.TCPConnector(
+            limit_per_host=HTTP_LIMIT_PER_HOST,
+            keepalive_timeout=HTTP_KEEPALIVE,
+            ttl_dns_cache=HTTP_KEEPALIVE,
+            enable_cleanup_closed=True,
+        )
+        session = aiohttp.ClientSession(
+            connector=connector, headers={"User-Agent": SERVER_SOFTWARE}
+        )
+        client = cls(session, owns_session=True, executor=executor)
+
+        async def close(_):
+            client._unsub_close = None
+            await client.close()
+
+        client._unsub_close = hass.bus.async_listen_once(
+            EVENT_HOMEASSISTANT_CLOSE, close
+        )
+        return client
+
+    async def close(self) -> None:
+        """Close the session if we created it."""
+        if self._unsub_close is not None:
+            self._unsub_close()
+            self._unsub_close = None
+        self._entries.clear()
+        if self._owns_session and not self._session.closed:
+            await self._session.close()
+
+    async def get_json(self, url, params, revalidate=False):
+        """GET url and return the decoded json, None for 204 No Content.
+        With revalidate a fresh response is checked with the api anyway.
+        """
+        key = (url, tuple(sorted(params.items())))
+        metrics.count("http_lookups")
+        entry = self._entries.get(key)
+        if not revalidate and entry is not None and entry.expires > time.monotonic():
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry.data
+
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = asyncio.ensure_future(
+                self._request(key, url, params, entry)
+            )
+            pending.add_done_callback(lambda _: self._pending.pop(key, None))
+        else:
+            self.hits += 1
+        return await asyncio.shield(pending)
+
+    async def _request(self, key, url, params, entry):
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+
+        self.requests += 1
+        metrics.count("requests")
+        async with self._session.get(
+            url, params=params, headers=headers, timeout=self._timeout
+        ) as resp:
+            _LOGGER.debug("requested %s %s %s", resp.url, params, resp.status)
+
+            if resp.status == 304 and entry is not None:
+                self.not_modified += 1
+                metrics.count("not_modified")
+                entry.expires = time.monotonic() + self._ttl(entry.data)
+                self._entries.move_to_end(key)
+                return entry.data
+
+            if resp.status == 204:
+                # Not published yet, ask again next time.
+                self._entries.pop(key, None)
+                return None
+
+            resp.raise_for_status()
+            # Decoding a multi area response is too slow for the event loop.
+            body = await resp.read()
+            metrics.count("bytes", len(body))
+            etag = resp.headers.get("ETag")
+            last_modified = resp.headers.get("Last-Modified")
+
+        loop = asyncio.get_running_loop()
+        with metrics.timer("decode"):
+            data = await loop.run_in_executor(self.executor, json_loads, body)
+        self._entries[key] = _Entry(
+            data, etag, last_modified, time.monotonic() + self._ttl(data)
+        )
+        self._entries.move_to_end(key)
+        while len(self._entries) > HTTP_CACHE_SIZE:
+            self._entries.popitem(last=False)
+        return data
+
+    @staticmethod
+    def _ttl(data) -> int:
+        if PriceCache.cacheable(data):
+            return HTTP_CACHE_TTL_PUBLISHED
+        return HTTP_CACHE_TTL
@@ -0,0 +1,83 @@
+import logging
+import math
+import time
+
+from homeassistant.util import dt as dt_utils
+
+from .const import _PRICE_IN, SHARED_MAX_AGE
+from .costs import CostEvaluator
+from .metrics import metrics
+
+_LOGGER = logging.getLogger(__name__)
+
+__all__ = ["ComputedPrices"]
+
+# Days kept per configuration, today and tomorrow and the ones they replace.
+_KEEP = 4
+
+
+class ComputedPrices:
+    """The prices for one area and currency with VAT, price type and
+    additional costs, computed once for every sensor that has them.
+
+    What is left for the sensors is cents, rounding and the stats of the
+    rounded prices. Templates that reads states from HA are computed again
+    when a sensor asks for fresh prices, but not more than once per
+    SHARED_MAX_AGE seconds.
+    """
+
+    def __init__(self, template, price_type, vat):
+        self.costs = CostEvaluator(template)
+        self.unit = _PRICE_IN[price_type]
+        self.vat = float(1 + vat)
+        # id(data) -> (data, when, slots)
+        self._days = {}
+
+    def clear(self) -> None:
+        """Forget every computed day."""
+        self._days.clear()
+
+    def day(self, data, fresh=False) -> list:
+        """Returns the slots for the data for a day.
+
+        slots is a list of (start, end, price) in local time where price is
+        None for junk from the api, the same list is returned until the data
+        changes so the sensors can tell if they need to do anything.
+        """
+        if data is None or not isinstance(data, dict):
+            return []
+
+        entry = self._days.get(id(data))
+        if entry is not None and entry[0] is data:
+            age = time.monotonic() - entry[1]
+            if not fresh or self.costs.static or age < SHARED_MAX_AGE:
+                return entry[2]
+
+        slots = self._compute(data)
+        if len(self._days) >= _KEEP:
+            self._days.pop(next(iter(self._days)))
+        self._days[id(data)] = (data, time.monotonic(), slots)
+        return slots
+
+    @metrics.timed("compute")
+    def _compute(self, data):
+        # The slots are made in the executor when the data is fetched.
+        items = data.get("slots")
+        if items is None:
+            items = list(data["values"].slots(dt_utils.DEFAULT_TIME_ZONE))
+        prices = [
+            (start, value / self.unit * self.vat)
+            for start, _, value in items
+            if not math.isinf(value)
+        ]
+        # All the additional costs for the day in one go.
+        costs = iter(self.costs.evaluate_many(prices))
+        valid = iter(prices)
+
+        slots = []
+        for start, end, value in items:
+            price = None
+            if not math.isinf(value):
+                price = next(valid)[1] + next(costs)
+            slots.append((start, end, price))
+        return slots
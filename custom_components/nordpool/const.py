@@ -9,6 +9,50 @@ EVENT_NEW_DAY = "nordpool_update_day"
 EVENT_NEW_PRICE = "nordpool_update_new_price"
 SENTINEL = object()
 
+# Persistent cache of published day-ahead prices.
+CACHE_STORAGE_KEY = f"{DOMAIN}.prices"
+CACHE_STORAGE_VERSION = 1
+CACHE_SAVE_DELAY = 10
+CACHE_KEEP_DAYS = 3
+
+# Tomorrow's prices are usually published around 12:45 CET. We start asking
+# a bit before, poll every POLL_INTERVAL seconds until POLL_FAST_WINDOW
+# seconds after the expected time and then back off up to POLL_MAX_INTERVAL.
+PUBLISH_HOUR = 12
+PUBLISH_MINUTE = 45
+POLL_START_MINUTE = 40
+POLL_INTERVAL = 60
+POLL_FAST_WINDOW = 15 * 60
+POLL_MAX_INTERVAL = 30 * 60
+POLL_LAST_HOUR = 23
+PUBLISH_HISTORY = 30
+
+# SQLite file in .storage with every price we have fetched.
+HISTORY_FILE = f"{DOMAIN}.history.db"
+
+# Seconds the prices computed with a template that reads states are shared
+# between the sensors, they all update at the same time.
+SHARED_MAX_AGE = 1
+
+# How many currencies we fetch from the api at the same time.
+MAX_CONCURRENT_FETCHES = 4
+
+# Threads in the pool that parses the prices.
+EXECUTOR_WORKERS = 2
+
+# Most days the hourly_range service fetches in one call.
+RANGE_MAX_DAYS = 93
+
+# Http client for the api.
+HTTP_TIMEOUT = 30
+HTTP_KEEPALIVE = 60
+HTTP_LIMIT_PER_HOST = MAX_CONCURRENT_FETCHES
+# Seconds a response is reused without asking the api again, published
+# day-ahead prices doesn't change so they are kept for a day.
+HTTP_CACHE_TTL = 300
+HTTP_CACHE_TTL_PUBLISHED = 24 * 60 * 60
+HTTP_CACHE_SIZE = 64
+
 _CURRENCY_LIST = ["DKK", "EUR", "NOK", "SEK"]
 
 
@@ -18,6 +62,8 @@ NAME = DOMAIN
 VERSION = "0.0.18"
 ISSUEURL = "https://github.com/custom-components/nordpool/issues"
 
+# The day-ahead delivery day runs from midnight to midnight CET.
+MARKET_TZ = "Europe/Stockholm"
 
 tzs = {
     "DK1": "Europe/Copenhagen",
@@ -93,8 +139,6 @@ AREA_TO_COUNTRY = {
     "PL ": "PL",
 }
 
-INVALID_VALUES = frozenset((None, float("inf")))
-
 DEFAULT_TEMPLATE = "{{0.0|float}}"
 
 
@@ -0,0 +1,172 @@
+import logging
+
+from jinja2 import Environment, TemplateSyntaxError, nodes
+from jinja2 import pass_context
+
+from .metrics import metrics
+from .misc import template_variables
+
+_LOGGER = logging.getLogger(__name__)
+
+__all__ = ["CostEvaluator"]
+
+# Variables we give the template ourself, anything else is read from HA.
+_OWN_VARIABLES = frozenset(("now", "current_price"))
+# Methods on now() that doesn't take any arguments.
+_NOW_METHODS = frozenset(("weekday", "isoweekday", "date", "time", "isocalendar"))
+_MEMO_SIZE = 4096
+
+
+def _faker(dt):
+    def inner(*_, **__):
+        return dt
+
+    return pass_context(inner)
+
+
+def _now_fields(source):
+    """Returns the attributes and methods the template reads from now(),
+    or None if now() is used in a way we dont understand.
+    """
+    env = Environment(extensions=["jinja2.ext.loopcontrols", "jinja2.ext.do"])
+    try:
+        tree = env.parse(source)
+    except TemplateSyntaxError:
+        return None
+
+    parents = {}
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        for child in node.iter_child_nodes():
+            parents[id(child)] = node
+            stack.append(child)
+
+    fields = set()
+    for call in tree.find_all(nodes.Call):
+        if not (isinstance(call.node, nodes.Name) and call.node.name == "now"):
+            continue
+        attr = parents.get(id(call))
+        if not isinstance(attr, nodes.Getattr):
+            # Something like {% set n = now() %}
+            return None
+        method = parents.get(id(attr))
+        if isinstance(method, nodes.Call) and method.node is attr:
+            if attr.attr not in _NOW_METHODS or method.args or method.kwargs:
+                return None
+            fields.add(attr.attr + "()")
+        else:
+            fields.add(attr.attr)
+
+    return tuple(sorted(fields))
+
+
+class CostEvaluator:
+    """Evaluates the additional_costs template for price slots.
+
+    The template is inspected once. When it only reads now() and current_price
+    the results are memoized by the parts of now() it reads and the price,
+    templates that only depends on the hour of the day are compiled into a
+    table lookup.
+    """
+
+    def __init__(self, template):
+        self.template = template
+        self._memo = {}
+        self._fn = None
+
+        variables = template_variables(template)
+        # True if the template doesn't read any states from HA.
+        self.static = variables is not None and variables <= _OWN_VARIABLES
+        self._fields = _now_fields(template.template) if self.static else None
+        self._reads_price = self.static and "current_price" in variables
+
+        if self._fields is not None and not self._reads_price:
+            if not self._fields:
+                self._fn = self._fixed
+            elif self._fields == ("hour",):
+                self._fn = self._hourly
+
+        _LOGGER.debug(
+            "Template %s static %s now fields %s reads price %s compiled %s",
+            template.template,
+            self.static,
+            self._fields,
+            self._reads_price,
+            self._fn is not None,
+        )
+
+    @property
+    def reads_time(self) -> bool:
+        """If the costs can depend on the time of the slot."""
+        return self._fields != ()
+
+    def render(self, dt, price) -> float:
+        """Render the template as a float."""
+        metrics.count("template_renders")
+        value = self.template.async_render(now=_faker(dt), current_price=price)
+
+        # Seems like the template is rendered as a string if the number is complex
+        # Just force it to be a float.
+        if not isinstance(value, (int, float)):
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                _LOGGER.exception(
+                    "Failed to convert %s %s to float",
+                    value,
+                    type(value),
+                )
+                raise
+        return value
+
+    def _key(self, dt, price):
+        key = []
+        for field in self._fields:
+            if field.endswith("()"):
+                key.append(getattr(dt, field[:-2])())
+            else:
+                key.append(getattr(dt, field))
+        if self._reads_price:
+            key.append(price)
+        return tuple(key)
+
+    def _fixed(self, dt, price):
+        if not self._memo:
+            self._memo[()] = self.render(dt, price)
+        return self._memo[()]
+
+    def _hourly(self, dt, price):
+        table = self._memo.get("hours")
+        if table is None:
+            table = self._memo["hours"] = [
+                self.render(dt.replace(hour=hour), price) for hour in range(24)
+            ]
+        return table[dt.hour]
+
+    def __call__(self, dt, price) -> float:
+        """Additional costs for a slot starting at dt with the price."""
+        metrics.count("template_lookups")
+        return self._lookup(dt, price)
+
+    def _lookup(self, dt, price) -> float:
+        if self._fn is not None:
+            return self._fn(dt, price)
+        if self._fields is None:
+            return self.render(dt, price)
+
+        key = self._key(dt, price)
+        value = self._memo.get(key)
+        if value is None:
+            if len(self._memo) >= _MEMO_SIZE:
+                self._memo.clear()
+            value = self._memo[key] = self.render(dt, price)
+        return value
+
+    def evaluate_many(self, slots) -> list:
+        """Additional costs for a list of (dt, price) slots, eg a whole day."""
+        metrics.count("template_lookups", len(slots))
+        if self._fn is not None:
+            fn = self._fn
+            return [fn(dt, price) for dt, price in slots]
+        return [self._lookup(dt, price) for dt, price in slots]
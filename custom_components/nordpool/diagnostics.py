@@ -0,0 +1,37 @@
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+
+from .const import DOMAIN
+from .metrics import metrics
+
+
+async def async_get_config_entry_diagnostics(
+    hass: HomeAssistant, entry: ConfigEntry
+) -> dict:
+    """The metrics and what the integration has loaded, for the diagnostics
+    download.
+    """
+    res = {"config": dict(entry.data), "metrics": metrics.snapshot()}
+
+    api = hass.data.get(DOMAIN)
+    if api is None:
+        return res
+
+    res["areas"] = list(api.areas)
+    res["currencies"] = list(api.currency)
+    res["complete"] = sorted(f"{currency} {day}" for currency, day in api._complete)
+    if api.client is not None:
+        res["client"] = {
+            "hits": api.client.hits,
+            "requests": api.client.requests,
+            "not_modified": api.client.not_modified,
+        }
+    if api.poller is not None:
+        res["publication"] = {
+            "published_at": api.poller.published_at,
+            "probes": api.poller.probes,
+            "seconds_late": {str(k): v for k, v in api.poller.lateness.items()},
+        }
+    if api.history is not None:
+        res["history_area_days"] = len(api.history)
+    return res
@@ -0,0 +1,273 @@
+import logging
+import sqlite3
+import threading
+import zlib
+from datetime import date, datetime, timezone
+
+from homeassistant.const import EVENT_HOMEASSISTANT_CLOSE
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.json import json_bytes
+from homeassistant.helpers.storage import STORAGE_DIR
+from homeassistant.util.json import json_loads
+
+from .aio_price import parse_utc
+from .cache import PriceCache
+from .const import HISTORY_FILE
+from .series import PriceSeries
+from .zones import async_load_zones, day_bounds
+
+_LOGGER = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS prices (
+    area TEXT NOT NULL,
+    currency TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (area, currency, start)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS days (
+    currency TEXT NOT NULL,
+    delivery_date TEXT NOT NULL,
+    area TEXT NOT NULL,
+    updated TEXT NOT NULL,
+    PRIMARY KEY (currency, delivery_date, area)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS payloads (
+    currency TEXT NOT NULL,
+    delivery_date TEXT NOT NULL,
+    areas TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    PRIMARY KEY (currency, delivery_date, areas)
+) WITHOUT ROWID;
+"""
+
+
+def _iso(epoch) -> str:
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _areas_key(areas) -> str:
+    return ",".join(sorted(areas))
+
+
+def payload_areas(payload) -> list:
+    """The areas a DayAheadPrices response has prices for."""
+    return list(payload["multiAreaEntries"][0]["entryPerArea"])
+
+
+def payload_rows(payload):
+    """(area, start, end, value) from a DayAheadPrices response, epoch seconds."""
+    for row in payload["multiAreaEntries"]:
+        start = int(parse_utc(row["deliveryStart"]).timestamp())
+        end = int(parse_utc(row["deliveryEnd"]).timestamp())
+        for area, value in row["entryPerArea"].items():
+            yield area, start, end, float(value)
+
+
+class PriceHistory:
+    """Append only SQLite store of the published day-ahead prices.
+
+    Prices are kept by (area, currency, start) and the days table has the
+    delivery dates (CET) that are complete for a currency and area, so we
+    know what we don't have to ask the api for again. The responses are
+    kept compressed as well, by the areas they are for, so the actions can
+    return them as the api sent them. Everything that touches the database
+    runs in the executor.
+    """
+
+    def __init__(self, hass: HomeAssistant, path=None):
+        self._hass = hass
+        self._path = path or hass.config.path(STORAGE_DIR, HISTORY_FILE)
+        self._conn = None
+        self._lock = threading.Lock()
+        # (currency, "YYYY-MM-DD", area) for every complete delivery date.
+        self._covered = set()
+        # (currency, "YYYY-MM-DD", "AREA,AREA") for every stored response.
+        self._payloads = set()
+        self._unsub_close = None
+
+    def _open(self):
+        conn = sqlite3.connect(self._path, check_same_thread=False)
+        conn.executescript(_SCHEMA)
+        covered = {
+            tuple(row)
+            for row in conn.execute("SELECT currency, delivery_date, area FROM days")
+        }
+        payloads = {
+            tuple(row)
+            for row in conn.execute(
+                "SELECT currency, delivery_date, areas FROM payloads"
+            )
+        }
+        return conn, covered, payloads
+
+    async def async_load(self) -> None:
+        """Open the database and read what delivery dates it has."""
+        self._conn, self._covered, self._payloads = (
+            await self._hass.async_add_executor_job(self._open)
+        )
+        self._unsub_close = self._hass.bus.async_listen_once(
+            EVENT_HOMEASSISTANT_CLOSE, self._async_on_close
+        )
+        _LOGGER.debug("Price history has %s area days", len(self._covered))
+
+    async def _async_on_close(self, _):
+        self._unsub_close = None
+        await self.async_close()
+
+    async def async_close(self) -> None:
+        if self._unsub_close is not None:
+            self._unsub_close()
+            self._unsub_close = None
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            await self._hass.async_add_executor_job(conn.close)
+
+    def __len__(self):
+        """Number of complete area and delivery dates we have."""
+        return len(self._covered)
+
+    def has(self, currency, delivery_date, areas) -> bool:
+        """If every area is stored for the delivery date."""
+        day = str(delivery_date)
+        return all((currency, day, area) in self._covered for area in areas)
+
+    def _add(self, currency, day, updated, rows, key, payload):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO prices VALUES (?, ?, ?, ?, ?)",
+                [(area, currency, *row) for area, *row in rows],
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO days VALUES (?, ?, ?, ?)",
+                [(currency, day, area, updated) for area in {r[0] for r in rows}],
+            )
+            if payload is not None:
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO payloads VALUES (?, ?, ?, ?)",
+                    (currency, day, key, zlib.compress(json_bytes(payload))),
+                )
+
+    async def async_add_payload(self, currency, delivery_date, payload) -> None:
+        """Store a DayAheadPrices response if it's complete and new to us."""
+        if self._conn is None or not PriceCache.cacheable(payload):
+            return
+        day = str(delivery_date)
+        areas = payload_areas(payload)
+        key = _areas_key(areas)
+        stored = (currency, day, key) in self._payloads
+        if stored and self.has(currency, day, areas):
+            return
+        rows = [
+            row
+            for row in payload_rows(payload)
+            if (currency, day, row[0]) not in self._covered
+        ]
+
+        await self._hass.async_add_executor_job(
+            self._add,
+            currency,
+            day,
+            payload.get("updatedAt", ""),
+            rows,
+            key,
+            None if stored else payload,
+        )
+        self._covered.update((currency, day, row[0]) for row in rows)
+        self._payloads.add((currency, day, key))
+        _LOGGER.debug("Added %s %s %s to the history", currency, day, len(rows))
+
+    def _read_payload(self, currency, day, key):
+        with self._lock:
+            (blob,) = self._conn.execute(
+                "SELECT payload FROM payloads WHERE currency = ? "
+                "AND delivery_date = ? AND areas = ?",
+                [currency, day, key],
+            ).fetchone()
+        return json_loads(zlib.decompress(blob))
+
+    async def async_raw_payload(self, currency, delivery_date, areas):
+        """The DayAheadPrices response for exactly these areas as the api sent
+        it, or None.
+        """
+        day, key = str(delivery_date), _areas_key(areas)
+        if self._conn is None or (currency, day, key) not in self._payloads:
+            return None
+        return await self._hass.async_add_executor_job(
+            self._read_payload, currency, day, key
+        )
+
+    def _select(self, currency, areas, start, end):
+        marks = ",".join("?" * len(areas))
+        with self._lock:
+            return self._conn.execute(
+                "SELECT area, start, end, value FROM prices WHERE currency = ? "
+                f"AND area IN ({marks}) AND start >= ? AND start < ? ORDER BY start",
+                [currency, *areas, start, end],
+            ).fetchall()
+
+    def _read_day(self, currency, day, areas, start, end):
+        rows = self._select(currency, areas, start, end)
+        marks = ",".join("?" * len(areas))
+        with self._lock:
+            (updated,) = self._conn.execute(
+                "SELECT max(updated) FROM days WHERE currency = ? "
+                f"AND delivery_date = ? AND area IN ({marks})",
+                [currency, day, *areas],
+            ).fetchone()
+        return rows, updated
+
+    @staticmethod
+    async def _day_bounds(delivery_date):
+        """Epoch seconds of the start and end of the delivery date, CET."""
+        await async_load_zones()
+        if isinstance(delivery_date, str):
+            delivery_date = date.fromisoformat(delivery_date)
+        start, end, _ = day_bounds(None, delivery_date)
+        return start, end
+
+    async def async_payload(self, currency, delivery_date, areas):
+        """A DayAheadPrices like response from the history or None.
+
+        It has the fields the integration uses, the block and area
+        aggregates the api sends is left out. async_raw_payload has them.
+        """
+        if self._conn is None or not areas:
+            return None
+        if not self.has(currency, delivery_date, areas):
+            return None
+
+        start, end = await self._day_bounds(delivery_date)
+        rows, updated = await self._hass.async_add_executor_job(
+            self._read_day, currency, str(delivery_date), list(areas), start, end
+        )
+        entries = {}
+        for area, row_start, row_end, value in rows:
+            entry = entries.get(row_start)
+            if entry is None:
+                entry = entries[row_start] = {
+                    "deliveryStart": _iso(row_start),
+                    "deliveryEnd": _iso(row_end),
+                    "entryPerArea": {},
+                }
+            entry["entryPerArea"][area] = value
+
+        return {
+            "deliveryDateCET": str(delivery_date),
+            "updatedAt": updated,
+            "deliveryAreas": list(areas),
+            "market": "DayAhead",
+            "multiAreaEntries": list(entries.values()),
+            "currency": currency,
+        }
+
+    async def async_series(self, area, currency, start, end) -> PriceSeries:
+        """The stored prices with a start in [start, end), epoch seconds."""
+        if self._conn is None:
+            return PriceSeries()
+        rows = await self._hass.async_add_executor_job(
+            self._select, currency, [area], int(start), int(end)
+        )
+        return PriceSeries.from_rows([row[1:] for row in rows])
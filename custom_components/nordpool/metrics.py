@@ -0,0 +1,154 @@
+import asyncio
+import functools
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+
+__all__ = ["Histogram", "Metrics", "metrics"]
+
+# Upper bounds of the latency buckets in ms, the last bucket is everything slower.
+BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# Counters for the lookups and the misses of every cache, for the hit rates.
+HIT_RATES = {
+    "http": ("http_lookups", "requests"),
+    "template": ("template_lookups", "template_renders"),
+    "stored": ("stored_lookups", "stored_misses"),
+}
+
+
+class Histogram:
+    """Latencies of one stage in fixed buckets, with the count, sum and max."""
+
+    __slots__ = ("counts", "count", "total", "max", "last")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def observe(self, ms) -> None:
+        self.counts[bisect_left(BUCKETS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.last = ms
+        if ms > self.max:
+            self.max = ms
+
+    def percentile(self, q) -> float:
+        """Upper bound of the bucket the q (0-100) percentile is in, the max
+        for the last bucket.
+        """
+        if not self.count:
+            return None
+        rank = self.count * q / 100
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return round(min(bound, self.max), 3)
+        return round(self.max, 3)
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count, 3) if self.count else None,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "max_ms": round(self.max, 3),
+            "last_ms": round(self.last, 3),
+            "buckets": {
+                f"le_{bound}": count for bound, count in zip(BUCKETS, self.counts)
+            }
+            | {"inf": self.counts[-1]},
+        }
+
+
+class Metrics:
+    """Latency histograms by stage and counters for the hot paths.
+
+    Parsing runs in the executor so everything that changes the numbers
+    holds a lock, it's only held for a few additions.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.timings = {}
+        self.counters = Counter()
+
+    def observe(self, stage, ms) -> None:
+        with self._lock:
+            histogram = self.timings.get(stage)
+            if histogram is None:
+                histogram = self.timings[stage] = Histogram()
+            histogram.observe(ms)
+
+    def count(self, name, n=1) -> None:
+        with self._lock:
+            self.counters[name] += n
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, (time.perf_counter() - start) * 1000)
+
+    def timed(self, stage):
+        """Decorator that times a function or coroutine function as stage."""
+
+        def decorator(fn):
+            if asyncio.iscoroutinefunction(fn):
+
+                @functools.wraps(fn)
+                async def async_wrapper(*args, **kwargs):
+                    with self.timer(stage):
+                        return await fn(*args, **kwargs)
+
+                return async_wrapper
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.timer(stage):
+                    return fn(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def hit_rate(self, name) -> float:
+        lookups, misses = (self.counters[key] for key in HIT_RATES[name])
+        if not lookups:
+            return None
+        return round(max(0.0, 1 - misses / lookups), 3)
+
+    def slowest(self, exclude=("refresh",)):
+        """The stage with the slowest last call, or None. The refresh is
+        left out as the fetch, parse and join is a part of it.
+        """
+        stages = [stage for stage in self.timings if stage not in exclude]
+        if not stages:
+            return None
+        return max(stages, key=lambda stage: self.timings[stage].last)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "timings": {k: v.as_dict() for k, v in sorted(self.timings.items())},
+                "counters": dict(sorted(self.counters.items())),
+                "hit_rates": {name: self.hit_rate(name) for name in HIT_RATES},
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self.timings.clear()
+            self.counters.clear()
+
+
+# Shared by everything in the integration, like the logger.
+metrics = Metrics()
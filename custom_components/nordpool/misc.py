@@ -1,14 +1,12 @@
 import logging
 from collections import defaultdict
-from operator import itemgetter
-from statistics import mean
 from decimal import Decimal
 
-import pytz
 from homeassistant.util import dt as dt_util
-from pytz import timezone
+from jinja2 import Environment, TemplateSyntaxError, meta
 
-UTC = pytz.utc
+from .series import PriceArray
+from .zones import market_zone
 
 __all__ = [
     "is_new",
@@ -18,12 +16,11 @@ __all__ = [
     "end_of",
     "stock",
     "add_junk",
+    "template_variables",
 ]
 
 _LOGGER = logging.getLogger(__name__)
 
-stockholm_tz = timezone("Europe/Stockholm")
-
 
 def exceptions_raiser():
     """Utility to check that all exceptions are raised."""
@@ -38,6 +35,18 @@ def exceptions_raiser():
         raise got
 
 
+def template_variables(template):
+    """Returns the variables a template reads from its context,
+    or None if the template cant be parsed.
+    """
+    source = getattr(template, "template", template)
+    env = Environment(extensions=["jinja2.ext.loopcontrols", "jinja2.ext.do"])
+    try:
+        return frozenset(meta.find_undeclared_variables(env.parse(source)))
+    except TemplateSyntaxError:
+        return None
+
+
 def round_decimal(number, decimal_places=3):
     decimal_value = Decimal(number)
     return decimal_value.quantize(Decimal(10) ** -decimal_places)
@@ -52,7 +61,7 @@ def add_junk(d):
 
 def stock(d):
     """convert datetime to stocholm time."""
-    return d.astimezone(stockholm_tz)
+    return d.astimezone(market_zone())
 
 
 def start_of(d, typ_="hour"):
@@ -120,20 +129,17 @@ def has_junk(data) -> bool:
 def extract_attrs(data) -> dict:
     """extract attrs"""
     d = defaultdict(list)
-    items = [i.get("value") for i in data]
 
     if len(data):
-        data = sorted(data, key=itemgetter("start"))
-        offpeak1 = [i.get("value") for i in data[0:8]]
-        peak = [i.get("value") for i in data[8:20]]
-        offpeak2 = [i.get("value") for i in data[20:]]
-
-        d["Peak"] = mean(peak)
-        d["Off-peak 1"] = mean(offpeak1)
-        d["Off-peak 2"] = mean(offpeak2)
-        d["Average"] = mean(items)
-        d["Min"] = min(items)
-        d["Max"] = max(items)
+        starts = [dt_util.as_local(i["start"]) for i in data]
+        stats = PriceArray(starts, [i.get("value") for i in data]).stats()
+
+        d["Peak"] = stats["peak"]
+        d["Off-peak 1"] = stats["off_peak_1"]
+        d["Off-peak 2"] = stats["off_peak_2"]
+        d["Average"] = stats["average"]
+        d["Min"] = stats["min"]
+        d["Max"] = stats["max"]
 
         return d
 
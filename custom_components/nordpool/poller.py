@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import random
+from collections import OrderedDict
+from datetime import timedelta
+
+import aiohttp
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.dispatcher import async_dispatcher_send
+from homeassistant.helpers.event import async_call_later
+from homeassistant.util import dt as dt_utils
+
+from .aio_price import AioPrices, InvalidValueException
+from .const import (
+    EVENT_NEW_PRICE,
+    MARKET_TZ,
+    POLL_FAST_WINDOW,
+    POLL_INTERVAL,
+    POLL_LAST_HOUR,
+    POLL_MAX_INTERVAL,
+    POLL_START_MINUTE,
+    PUBLISH_HISTORY,
+    PUBLISH_HOUR,
+    PUBLISH_MINUTE,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class PublicationPoller:
+    """Polls for tomorrow's prices around the time they are published.
+
+    Until the prices are out only one delivery date for one area and
+    currency is asked for. When they are, every currency is fetched and
+    the sensors are told about the new prices.
+    """
+
+    def __init__(self, hass: HomeAssistant, api):
+        self._hass = hass
+        self._api = api
+        self._unsub = None
+        self._expected = None
+        self._last = None
+        self._delivery_date = None
+        self._slow_polls = 0
+        # Probes sent for the current delivery date.
+        self.probes = 0
+        self.published_at = None
+        # Seconds after the expected time the prices was seen, by delivery date.
+        self.lateness = OrderedDict()
+
+    def in_window(self) -> bool:
+        """If we are between the first and last poll of the day."""
+        now = dt_utils.now().astimezone(dt_utils.get_time_zone(MARKET_TZ))
+        return (PUBLISH_HOUR, POLL_START_MINUTE) <= (now.hour, now.minute) and (
+            now.hour < POLL_LAST_HOUR
+        )
+
+    async def start(self, _=None) -> None:
+        """Start polling for the delivery date after today, CET."""
+        self.stop()
+        market = await dt_utils.async_get_time_zone(MARKET_TZ)
+        now = dt_utils.now().astimezone(market)
+        self._expected = now.replace(
+            hour=PUBLISH_HOUR, minute=PUBLISH_MINUTE, second=0, microsecond=0
+        )
+        self._last = now.replace(hour=POLL_LAST_HOUR, minute=0, second=0, microsecond=0)
+        self._delivery_date = now.date() + timedelta(days=1)
+        self._slow_polls = 0
+        self.probes = 0
+        _LOGGER.debug("Polling for the prices for %s", self._delivery_date)
+        await self._poll()
+
+    @callback
+    def stop(self) -> None:
+        """Cancel the next poll."""
+        if self._unsub is not None:
+            self._unsub()
+            self._unsub = None
+
+    def _next_delay(self, now) -> float:
+        """Seconds to the next poll, often close to the expected publication
+        and then exponentially less often.
+        """
+        if now < self._expected + timedelta(seconds=POLL_FAST_WINDOW):
+            delay = POLL_INTERVAL
+        else:
+            self._slow_polls += 1
+            delay = min(POLL_INTERVAL * 2**self._slow_polls, POLL_MAX_INTERVAL)
+        # Spread the requests from everyone a bit.
+        return delay * random.uniform(0.9, 1.1)
+
+    async def _probe(self) -> bool:
+        """One request to see if tomorrow's prices are out."""
+        api = self._api
+        if not api.currency or not api.areas:
+            # No sensors yet.
+            return False
+        self.probes += 1
+        spot = AioPrices(api.currency[0], api.client)
+        return await spot.published(self._delivery_date, api.areas[0])
+
+    async def _poll(self, _=None) -> None:
+        self._unsub = None
+        api = self._api
+        now = dt_utils.now()
+
+        try:
+            # The sensors might have gotten them already.
+            if not api.has_complete("tomorrow"):
+                if not await self._probe():
+                    self._schedule(now)
+                    return
+                if self._delivery_date not in self.lateness:
+                    self._record(now)
+
+            await api.update_tomorrow()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            _LOGGER.debug("Failed to poll for tomorrow's prices: %r", err)
+            self._schedule(now)
+            return
+        except InvalidValueException:
+            _LOGGER.debug("Tomorrow's prices are not complete yet")
+            self._schedule(now)
+            return
+
+        async_dispatcher_send(self._hass, EVENT_NEW_PRICE)
+        if not api.has_complete("tomorrow"):
+            self._schedule(now)
+
+    def _schedule(self, now) -> None:
+        delay = self._next_delay(now)
+        if now + timedelta(seconds=delay) > self._last:
+            _LOGGER.warning(
+                "Tomorrow's prices for %s are still not published, giving up",
+                self._delivery_date,
+            )
+            return
+        _LOGGER.debug("Polling for tomorrow's prices again in %.0f s", delay)
+        self._unsub = async_call_later(self._hass, delay, self._poll)
+
+    def _record(self, now) -> None:
+        """Keep how late the prices was, the resolution is the poll interval."""
+        late = (now - self._expected).total_seconds()
+        self.published_at = now
+        self.lateness[self._delivery_date] = late
+        while len(self.lateness) > PUBLISH_HISTORY:
+            self.lateness.popitem(last=False)
+        _LOGGER.info(
+            "Prices for %s seen %.0f s after the expected time after %s probes",
+            self._delivery_date,
+            late,
+            self.probes,
+        )
@@ -1,12 +1,10 @@
 import logging
 import math
-from operator import itemgetter
-from statistics import mean, median
 
 import homeassistant.helpers.config_validation as cv
 import voluptuous as vol
 from homeassistant.components.sensor import PLATFORM_SCHEMA
-from homeassistant.const import CONF_REGION
+from homeassistant.const import CONF_REGION, EntityCategory, UnitOfTime
 from homeassistant.helpers.dispatcher import async_dispatcher_connect
 from homeassistant.helpers.template import Template
 from homeassistant.util import dt as dt_utils
@@ -18,7 +16,6 @@ from homeassistant.components.sensor.const import (
 )
 
 from homeassistant.components.sensor import SensorEntity
-from jinja2 import pass_context
 
 from .const import (
     DOMAIN,
@@ -26,8 +23,6 @@ from .const import (
     EVENT_NEW_PRICE,
     EVENT_NEW_HOUR,
     SENTINEL,
-    RANDOM_MINUTE,
-    RANDOM_SECOND,
     DEFAULT_TEMPLATE,
     DEFAULT_REGION,
     _PRICE_IN,
@@ -35,8 +30,11 @@ from .const import (
     _CURRENTY_TO_CENTS,
     _CENT_MULTIPLIER,
 )
-from .misc import start_of, stock
-
+from .cheapest import cheapest_slots, cheapest_window
+from .metrics import metrics
+from .misc import start_of
+from .series import PriceArray
+from .zones import market_zone, zone
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -55,6 +53,10 @@ PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend(
         vol.Optional("price_type", default="kWh"): vol.In(list(_PRICE_IN.keys())),
         vol.Optional("price_in_cents", default=False): cv.boolean,
         vol.Optional("additional_costs", default=DEFAULT_TEMPLATE): cv.template,
+        # Adds the cheapest window of this long and the n cheapest slots in
+        # today and tomorrow as attributes.
+        vol.Optional("cheapest_window"): cv.positive_time_period,
+        vol.Optional("cheapest_slots"): vol.All(vol.Coerce(int), vol.Range(min=1)),
     }
 )
 
@@ -72,6 +74,8 @@ def _dry_setup(hass, config, add_devices, discovery_info=None):
     vat = config.get("VAT")
     use_cents = config.get("price_in_cents")
     ad_template = config.get("additional_costs")
+    cheapest_window = config.get("cheapest_window")
+    cheapest_slots = config.get("cheapest_slots")
     api = hass.data[DOMAIN]
     sensor = NordpoolSensor(
         friendly_name,
@@ -85,9 +89,17 @@ def _dry_setup(hass, config, add_devices, discovery_info=None):
         api,
         ad_template,
         hass,
+        cheapest_window=cheapest_window,
+        cheapest_slots=cheapest_slots,
     )
 
-    add_devices([sensor])
+    sensors = [sensor]
+    if not api.diagnostics_added:
+        # Only one set for the integration, the numbers are for all sensors.
+        api.diagnostics_added = True
+        sensors += [NordpoolDiagnosticSensor(api, kind) for kind in DIAGNOSTICS]
+
+    add_devices(sensors)
 
 
 async def async_setup_platform(hass, config, add_devices, discovery_info=None) -> True:
@@ -110,7 +122,7 @@ class NordpoolSensor(SensorEntity):
     _attr_state_class = SensorStateClass.TOTAL
     # Do not write list attributes to database.
     _unrecorded_attributes = frozenset(
-        {"raw_today", "raw_tomorrow", "today", "tomorrow"}
+        {"raw_today", "raw_tomorrow", "today", "tomorrow", "cheapest_slots"}
     )
 
     def __init__(
@@ -126,6 +138,8 @@ class NordpoolSensor(SensorEntity):
         api,
         ad_template,
         hass,
+        cheapest_window=None,
+        cheapest_slots=None,
     ) -> None:
         self._area = area
         self._currency = currency or _REGIONS[area][0]
@@ -139,6 +153,8 @@ class NordpoolSensor(SensorEntity):
         self._ad_template = ad_template
         self._hass = hass
         self._attr_force_update = True
+        self._cheapest_window = cheapest_window
+        self._cheapest_slots = cheapest_slots
 
         if vat is True:
             self._vat = _REGIONS[area][2]
@@ -174,8 +190,32 @@ class NordpoolSensor(SensorEntity):
             if self._ad_template.template in ("", None):
                 self._ad_template = cv.template(DEFAULT_TEMPLATE)
 
+        # Sensors with the same area, currency, VAT, price type and template
+        # shares the prices, only cents and rounding is done here.
+        self._computed = api.computed_prices(
+            self._area, self._currency, self._vat, price_type, self._ad_template
+        )
+        self._costs = self._computed.costs
+
+        # The prices by day, with the computed prices they was made from.
+        self._series = {}
+        # Only templates that doesn't read anything from HA can be cached
+        # until the data changes, the rest are computed every update.
+        self._static_template = self._costs.static
+
         # To control the updates.
         self._last_tick = None
+        # Bumped every time the rounded prices changes.
+        self._version = 0
+        # Start of the slot the current price is for, epoch seconds.
+        self._current_slot = None
+        # What the state was written with and the attributes for it, so we
+        # don't write or build the lists again when nothing has changed.
+        self._written = None
+        self._attributes = (None, None)
+        # The stats the day values was set from, and tomorrow_valid by version.
+        self._stats = None
+        self._tomorrow_valid = (None, None)
 
     @property
     def name(self) -> str:
@@ -230,26 +270,25 @@ class NordpoolSensor(SensorEntity):
         """Additional costs."""
         return self._additional_costs_value
 
+    def _relative(self, price) -> tuple:
+        """low_price and price_percent_to_average for the price."""
+        if not isinstance(price, (int, float)) or not isinstance(
+            self._average, (float, int)
+        ):
+            return None, None
+        return price < self._average * self._low_price_cutoff, price / self._average
+
     @property
     def low_price(self) -> bool:
         """Check if the price is lower then avg depending on settings"""
-        return (
-            self.current_price < self._average * self._low_price_cutoff
-            if isinstance(self.current_price, (int, float))
-            and isinstance(self._average, (float, int))
-            else None
-        )
+        return self._relative(self.current_price)[0]
 
     @property
     def price_percent_to_average(self) -> float:
         """Price in percent to average price"""
-        return (
-            self.current_price / self._average
-            if isinstance(self.current_price, (int, float))
-            and isinstance(self._average, (float, int))
-            else None
-        )
+        return self._relative(self.current_price)[1]
 
+    @metrics.timed("price")
     def _calc_price(self, value=None, fake_dt=None) -> float:
         """Calculate price based on the users settings."""
         if value is None:
@@ -259,29 +298,8 @@ class NordpoolSensor(SensorEntity):
             # _LOGGER.debug("api returned junk infinty %s", value)
             return None
 
-        def faker():
-            def inner(*_, **__):
-                return fake_dt or dt_utils.now()
-
-            return pass_context(inner)
-
         price = value / _PRICE_IN[self._price_type] * (float(1 + self._vat))
-        template_value = self._ad_template.async_render(
-            now=faker(), current_price=price
-        )
-
-        # Seems like the template is rendered as a string if the number is complex
-        # Just force it to be a float.
-        if not isinstance(template_value, (int, float)):
-            try:
-                template_value = float(template_value)
-            except (TypeError, ValueError):
-                _LOGGER.exception(
-                    "Failed to convert %s %s to float",
-                    template_value,
-                    type(template_value),
-                )
-                raise
+        template_value = self._costs(fake_dt or dt_utils.now(), price)
 
         self._additional_costs_value = template_value
         try:
@@ -305,19 +323,24 @@ class NordpoolSensor(SensorEntity):
 
     def _update(self):
         """Set attrs"""
-        today = self.today
+        stats = self._cached("today")[3]
+        if stats is self._stats:
+            # Today hasn't changed, only tomorrow or the current slot.
+            return
+        self._stats = stats
 
-        if not today:
+        if not stats:
             _LOGGER.debug("No data for today, unable to set attrs")
             return
 
-        self._average = mean(today)
-        self._min = min(today)
-        self._max = max(today)
-        self._off_peak_1 = mean(today[0:8])
-        self._off_peak_2 = mean(today[20:])
-        self._peak = mean(today[8:20])
-        self._mean = median(today)
+        # From the rounded prices, like the current price they are compared to.
+        self._average = stats["average"]
+        self._min = stats["min"]
+        self._max = stats["max"]
+        self._off_peak_1 = stats["off_peak_1"]
+        self._off_peak_2 = stats["off_peak_2"]
+        self._peak = stats["peak"]
+        self._mean = stats["median"]
 
     @property
     def current_price(self) -> float:
@@ -326,25 +349,44 @@ class NordpoolSensor(SensorEntity):
         # _LOGGER.debug("Current hours price for %s is %s", self.name, res)
         return res
 
-    def _someday(self, data) -> list:
-        """The data is already sorted in the xml,
-        but I don't trust that to continue forever. That's why we sort it ourselves."""
-        if data is None or data is SENTINEL:
-            return []
-
-        local_times = []
-        for item in data.get("values", []):
-            i = {
-                "start": dt_utils.as_local(item["start"]),
-                "end": dt_utils.as_local(item["end"]),
-                "value": item["value"],
-            }
-
-            local_times.append(i)
-
-        data["values"] = local_times
-
-        return sorted(data.get("values", []), key=itemgetter("start"))
+    def _refresh_series(self, force=False) -> None:
+        """Get the prices for today and tomorrow if the data has changed,
+        force asks for the template to be rendered again.
+        """
+        days = (("today", self._data_today), ("tomorrow", self._data_tomorrow))
+        previous = list(self._series.values())
+        for day, data in days:
+            slots = self._computed.day(data, fresh=force)
+            cached = self._series.get(day)
+            if cached is not None and cached[0] is slots:
+                continue
+
+            # After midnight today is what was tomorrow, it's already done.
+            promoted = next((i for i in previous if i[0] is slots), None)
+            if promoted is not None:
+                self._series[day] = promoted
+                self._version += 1
+                continue
+
+            raw = self._add_raw(slots)
+            if cached is not None and raw == cached[1]:
+                # Same prices after rounding, keep the lists and the stats.
+                self._series[day] = (slots, *cached[1:])
+                continue
+            values = [i["value"] for i in raw]
+            # The peak windows are in the area's time, not the one HA has.
+            stats = PriceArray(
+                [i["start"] for i in raw],
+                values,
+                zone(self._area) or market_zone(),
+            ).stats()
+            self._series[day] = (slots, raw, values, stats)
+            self._version += 1
+
+    def _cached(self, day) -> tuple:
+        if day not in self._series:
+            self._refresh_series()
+        return self._series[day]
 
     @property
     def today(self) -> list:
@@ -353,11 +395,7 @@ class NordpoolSensor(SensorEntity):
         Returns:
             list: sorted list where today[0] is the price of hour 00.00 - 01.00
         """
-        return [
-            self._calc_price(i["value"], fake_dt=i["start"])
-            for i in self._someday(self._data_today)
-            if i
-        ]
+        return self._cached("today")[2]
 
     @property
     def tomorrow(self) -> list:
@@ -366,15 +404,38 @@ class NordpoolSensor(SensorEntity):
         Returns:
             list: sorted where tomorrow[0] is the price of hour 00.00 - 01.00 etc.
         """
-        return [
-            self._calc_price(i["value"], fake_dt=i["start"])
-            for i in self._someday(self._data_tomorrow)
-            if i
-        ]
+        return self._cached("tomorrow")[2]
+
+    def _fingerprint(self) -> tuple:
+        """Everything the state and the attributes are made from."""
+        return (
+            self._version,
+            self._current_slot,
+            self._attr_native_value,
+            self._additional_costs_value,
+        )
 
     @property
     def extra_state_attributes(self) -> dict:
-        return {
+        fingerprint = self._fingerprint()
+        if self._attributes[0] == fingerprint:
+            return self._attributes[1]
+
+        with metrics.timer("attributes"):
+            attributes = self._build_attributes()
+        self._attributes = (fingerprint, attributes)
+        return attributes
+
+    def _build_attributes(self) -> dict:
+        # Everything but the current price is the same until the prices
+        # changes, so only the current slot is done on every tick.
+        if self._tomorrow_valid[0] != self._version:
+            self._tomorrow_valid = (self._version, self.tomorrow_valid)
+        tomorrow_valid = self._tomorrow_valid[1]
+
+        price = self.current_price
+        low_price, percent_to_average = self._relative(price)
+        attributes = {
             "average": self._average,
             "off_peak_1": self._off_peak_1,
             "off_peak_2": self._off_peak_2,
@@ -386,39 +447,79 @@ class NordpoolSensor(SensorEntity):
             "currency": self._currency,
             "country": _REGIONS[self._area][1],
             "region": self._area,
-            "low_price": self.low_price,
-            "price_percent_to_average": self.price_percent_to_average,
+            "low_price": low_price,
+            "price_percent_to_average": percent_to_average,
             "today": self.today,
             "tomorrow": self.tomorrow,
-            "tomorrow_valid": self.tomorrow_valid,
+            "tomorrow_valid": tomorrow_valid,
             "raw_today": self.raw_today,
             "raw_tomorrow": self.raw_tomorrow,
-            "current_price": self.current_price,
+            "current_price": price,
             "additional_costs_current_hour": self.additional_costs,
             "price_in_cents": self._use_cents,
         }
+        if self._cheapest_window or self._cheapest_slots:
+            cheapest = self.cheapest(self._cheapest_window, self._cheapest_slots)
+            if self._cheapest_window:
+                attributes["cheapest_window"] = cheapest["window"]
+            if self._cheapest_slots:
+                attributes["cheapest_slots"] = cheapest["slots"]
+        return attributes
+
+    def cheapest(self, duration=None, count=None, start=None, end=None) -> dict:
+        """The cheapest window that is duration long and the count cheapest
+        slots in today and tomorrow, with the prices of the sensor.
+
+        Only the slots that ends after start and starts before end are
+        used, start is now if it's not given.
+        """
+        after = (start or dt_utils.now()).timestamp()
+        before = end.timestamp() if end is not None else math.inf
+        times = {}
+        slots = []
+        for i in self.raw_today + self.raw_tomorrow:
+            slot_start, slot_end = i["start"].timestamp(), i["end"].timestamp()
+            if slot_end > after and slot_start < before:
+                times[slot_start], times[slot_end] = i["start"], i["end"]
+                slots.append((slot_start, slot_end, i["value"]))
+
+        res = {}
+        if duration is not None:
+            window = cheapest_window(slots, duration.total_seconds())
+            res["window"] = window and {
+                "start": times[window[0]],
+                "end": times[window[1]],
+                "average": round(window[2], self._precision),
+            }
+        if count:
+            res["slots"] = [
+                {"start": times[slot_start], "end": times[slot_end], "value": value}
+                for slot_start, slot_end, value in cheapest_slots(slots, count)
+            ]
+        return res
 
-    def _add_raw(self, data) -> list:
-        """Helper"""
-        result = []
-        for res in self._someday(data):
-            item = {
-                "start": res["start"],
-                "end": res["end"],
-                "value": self._calc_price(res["value"], fake_dt=res["start"]),
+    def _add_raw(self, slots) -> list:
+        """The computed prices in cents if the user wants and rounded."""
+        scale = _CENT_MULTIPLIER if self._use_cents else 1
+        precision = self._precision
+        return [
+            {
+                "start": start,
+                "end": end,
+                "value": round(price * scale, precision) if price is not None else None,
             }
-            result.append(item)
-        return result
+            for start, end, price in slots
+        ]
 
     @property
     def raw_today(self) -> list:
         """Raw today"""
-        return self._add_raw(self._data_today)
+        return self._cached("today")[1]
 
     @property
     def raw_tomorrow(self) -> list:
         """Raw tomorrow"""
-        return self._add_raw(self._data_tomorrow)
+        return self._cached("tomorrow")[1]
 
     @property
     def tomorrow_valid(self) -> bool:
@@ -432,12 +533,14 @@ class NordpoolSensor(SensorEntity):
 
         data = await self._api.today(self._area, self._currency)
         if data:
-            for item in self._someday(data):
-                if item["start"] <= local_now < item["end"]:
-                    self._current_price = item["value"]
-                    _LOGGER.debug(
-                        "Updated %s _current_price %s", self.name, item["value"]
-                    )
+            series = data["values"]
+            price = series.price_at(local_now.timestamp())
+            if price is not None:
+                self._current_price = price
+                self._current_slot = (
+                    series.start + series.index(local_now.timestamp()) * series.mtu
+                )
+                _LOGGER.debug("Updated %s _current_price %s", self.name, price)
         else:
             _LOGGER.debug("Cant update _update_current_price because it was no data")
 
@@ -455,19 +558,29 @@ class NordpoolSensor(SensorEntity):
         if today:
             self._data_today = today
 
-        now = dt_utils.now()
-        if self._data_tomorrow is SENTINEL and stock(now) >= stock(now).replace(
-            hour=13, minute=RANDOM_MINUTE, second=RANDOM_SECOND
-        ):
+        # Only once all of tomorrow is out, the poller sends EVENT_NEW_PRICE
+        # as soon as it is.
+        if self._api.has_complete("tomorrow", self._currency):
             tomorrow = await self._api.tomorrow(self._area, self._currency)
             if tomorrow:
                 self._data_tomorrow = tomorrow
 
+        self._refresh_series(force=not self._static_template)
         self._update()
         # Updates the current for this hour.
         await self._update_current_price()
         # This is not to make sure the correct template costs are set. Issue 258
         self._attr_native_value = self.current_price
+
+        # Only write when the prices or the current slot has changed, the
+        # tick is every 15 minutes and the attributes are big.
+        fingerprint = self._fingerprint()
+        if fingerprint == self._written:
+            _LOGGER.debug("Nothing has changed for %s, skipping the write", self.name)
+            metrics.count("skipped_writes")
+            return
+        self._written = fingerprint
+        metrics.count("state_writes")
         self.async_write_ha_state()
 
     async def handle_new_price(self):
@@ -489,4 +602,78 @@ class NordpoolSensor(SensorEntity):
             self._api._hass, EVENT_NEW_PRICE, self.handle_new_price
         )
         async_dispatcher_connect(self._api._hass, EVENT_NEW_HOUR, self.handle_new_hr)
+
+        # For the nordpool.cheapest action.
+        self._api.sensors[self.entity_id] = self
+        entity_id = self.entity_id
+        self.async_on_remove(lambda: self._api.sensors.pop(entity_id, None))
         await self.handle_new_hr()
+
+
+# The diagnostic sensors, by kind, with the name.
+DIAGNOSTICS = {
+    "requests": "Nordpool api requests",
+    "refresh": "Nordpool refresh time",
+}
+
+
+class NordpoolDiagnosticSensor(SensorEntity):
+    """How many requests we made to the api and how long the refreshes
+    takes, with the rest of the metrics as attributes.
+    """
+
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    _attr_should_poll = False
+    # Do not write the nested attributes to database.
+    _unrecorded_attributes = frozenset({"stages", "hit_rates"})
+
+    def __init__(self, api, kind) -> None:
+        self._api = api
+        self._kind = kind
+        self._attr_name = DIAGNOSTICS[kind]
+        self._attr_unique_id = f"{DOMAIN}_{kind}"
+        if kind == "requests":
+            self._attr_state_class = SensorStateClass.TOTAL_INCREASING
+        else:
+            self._attr_device_class = SensorDeviceClass.DURATION
+            self._attr_native_unit_of_measurement = UnitOfTime.MILLISECONDS
+            self._attr_state_class = SensorStateClass.MEASUREMENT
+
+    @property
+    def native_value(self):
+        if self._kind == "requests":
+            return metrics.counters["requests"]
+        refresh = metrics.timings.get("refresh")
+        return round(refresh.last, 3) if refresh is not None else None
+
+    @property
+    def extra_state_attributes(self) -> dict:
+        snapshot = metrics.snapshot()
+        if self._kind == "requests":
+            counters = snapshot["counters"]
+            return {
+                "bytes": counters.get("bytes", 0),
+                "not_modified": counters.get("not_modified", 0),
+                "state_writes": counters.get("state_writes", 0),
+                "skipped_writes": counters.get("skipped_writes", 0),
+                "template_renders": counters.get("template_renders", 0),
+                "hit_rates": snapshot["hit_rates"],
+            }
+        return {
+            "slowest_stage": metrics.slowest(),
+            "stages": {
+                stage: {k: timing[k] for k in ("count", "last_ms", "p95_ms", "max_ms")}
+                for stage, timing in snapshot["timings"].items()
+            },
+        }
+
+    async def handle_update(self):
+        self.async_write_ha_state()
+
+    async def async_added_to_hass(self):
+        await super().async_added_to_hass()
+        hass = self._api._hass
+        for event in (EVENT_NEW_HOUR, EVENT_NEW_PRICE):
+            self.async_on_remove(
+                async_dispatcher_connect(hass, event, self.handle_update)
+            )
@@ -0,0 +1,207 @@
+import math
+from array import array
+from datetime import datetime, timezone
+from functools import reduce
+
+__all__ = ["PriceArray", "PriceSeries", "PEAK_WINDOWS"]
+
+# Local start hour windows, [start, end)
+PEAK_WINDOWS = {
+    "off_peak_1": (0, 8),
+    "peak": (8, 20),
+    "off_peak_2": (20, 24),
+}
+
+
+class PriceArray:
+    """Prices for one area and day as a packed float64 array.
+
+    The local start hour of every slot is kept next to the price so the
+    peak windows works for any market time unit and on dst days. tz is the
+    timezone of the area, the peak windows are in its local time.
+    """
+
+    __slots__ = ("values", "hours")
+
+    def __init__(self, starts, values, tz=None):
+        pairs = [(s, v) for s, v in zip(starts, values) if v is not None]
+        self.values = array("d", (v for _, v in pairs))
+        if tz is not None:
+            self.hours = bytes(s.astimezone(tz).hour for s, _ in pairs)
+        else:
+            self.hours = bytes(s.hour for s, _ in pairs)
+
+    def __len__(self):
+        return len(self.values)
+
+    def percentile(self, q, ordered=None) -> float:
+        """q in 0-100, linear interpolation between the closest ranks."""
+        if ordered is None:
+            ordered = sorted(self.values)
+        if not ordered:
+            return None
+        pos = (len(ordered) - 1) * q / 100
+        low = math.floor(pos)
+        high = min(low + 1, len(ordered) - 1)
+        return ordered[low] + (ordered[high] - ordered[low]) * (pos - low)
+
+    def stats(self) -> dict:
+        """Average, min, max, median and the peak windows in one pass."""
+        if not self.values:
+            return {}
+
+        windows = {key: [] for key in PEAK_WINDOWS}
+        bounds = list(PEAK_WINDOWS.items())
+        low = high = self.values[0]
+        for hour, value in zip(self.hours, self.values):
+            if value < low:
+                low = value
+            elif value > high:
+                high = value
+            for key, (start, end) in bounds:
+                if start <= hour < end:
+                    windows[key].append(value)
+                    break
+
+        res = {
+            "average": math.fsum(self.values) / len(self.values),
+            "min": low,
+            "max": high,
+            "median": self.percentile(50),
+        }
+        for key, values in windows.items():
+            res[key] = math.fsum(values) / len(values) if values else None
+        return res
+
+
+class PriceSeries:
+    """Prices with a fixed market time unit (mtu).
+
+    Only the start of the first slot and the mtu, both in epoch seconds, and
+    the prices as a packed float64 array are kept. The start and end of a
+    slot is computed when it's needed. Slots without a price are nan.
+    """
+
+    __slots__ = ("start", "mtu", "values")
+
+    def __init__(self, start=0, mtu=3600, values=()):
+        self.start = int(start)
+        self.mtu = int(mtu)
+        self.values = values if isinstance(values, array) else array("d", values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __eq__(self, other):
+        if not isinstance(other, PriceSeries):
+            return NotImplemented
+        return (self.start, self.mtu, list(self.slots())) == (
+            other.start,
+            other.mtu,
+            list(other.slots()),
+        )
+
+    def __repr__(self):
+        return f"PriceSeries(start={self.start}, mtu={self.mtu}, len={len(self)})"
+
+    @property
+    def end(self) -> int:
+        return self.start + self.mtu * len(self.values)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """From (start, end, value) rows in epoch seconds, sorted by start.
+
+        Rows longer than the shortest one are repeated for each slot they cover.
+        """
+        if not rows:
+            return cls()
+
+        first = rows[0][0]
+        # Rows with the same start and end (dst) just ends up without a slot.
+        mtu = reduce(
+            math.gcd,
+            [int(end - start) for start, end, _ in rows]
+            + [int(start - first) for start, _, _ in rows],
+        )
+        if not mtu:
+            return cls(first)
+        values = array("d", [math.nan]) * ((int(rows[-1][1]) - first) // mtu)
+        for start, end, value in rows:
+            for i in range((int(start) - first) // mtu, (int(end) - first) // mtu):
+                values[i] = value
+        return cls(first, mtu, values)
+
+    @classmethod
+    def concat(cls, parts):
+        """Join series that follows each other."""
+        parts = [part for part in parts if len(part)]
+        if not parts:
+            return cls()
+        if len(parts) == 1:
+            return parts[0]
+
+        mtu = reduce(math.gcd, [part.mtu for part in parts])
+        if all(part.mtu == mtu for part in parts) and all(
+            a.end == b.start for a, b in zip(parts, parts[1:])
+        ):
+            values = array("d")
+            for part in parts:
+                values.extend(part.values)
+            return cls(parts[0].start, mtu, values)
+
+        return cls.from_rows([row for part in parts for row in part.rows()])
+
+    def between(self, start, end):
+        """The slots starting in [start, end), both in epoch seconds."""
+        first = max(0, -((self.start - int(start)) // self.mtu))
+        last = min(len(self.values), max(0, -((self.start - int(end)) // self.mtu)))
+        if first >= last:
+            return PriceSeries(self.start, self.mtu)
+        return PriceSeries(
+            self.start + first * self.mtu, self.mtu, self.values[first:last]
+        )
+
+    def index(self, when):
+        """Index of the slot that has when (epoch seconds) in it, or None.
+
+        The slots have a fixed length so this is just arithmetic.
+        """
+        i = (int(when) - self.start) // self.mtu
+        if 0 <= i < len(self.values):
+            return i
+        return None
+
+    def price_at(self, when):
+        """The price at when (epoch seconds), None if there isn't one."""
+        i = self.index(when)
+        if i is None or math.isnan(self.values[i]):
+            return None
+        return self.values[i]
+
+    def has_invalid(self) -> bool:
+        """True if any price is junk from the api."""
+        return any(math.isinf(v) for v in self.values)
+
+    def rows(self):
+        """(start, end, value) in epoch seconds, skips slots without a price."""
+        start, mtu = self.start, self.mtu
+        for i, value in enumerate(self.values):
+            if not math.isnan(value):
+                yield start + i * mtu, start + (i + 1) * mtu, value
+
+    def slots(self, tz=timezone.utc):
+        """(start, end, value) as datetimes in tz."""
+        prev = prev_dt = None
+        for start, end, value in self.rows():
+            # The end of a slot is the start of the next one.
+            start_dt = prev_dt if start == prev else datetime.fromtimestamp(start, tz)
+            prev, prev_dt = end, datetime.fromtimestamp(end, tz)
+            yield start_dt, prev_dt, value
+
+    def as_dicts(self, tz=timezone.utc) -> list:
+        """The dict form used in the attributes and service responses."""
+        return [
+            {"start": start, "end": end, "value": value}
+            for start, end, value in self.slots(tz)
+        ]
@@ -1,26 +1,33 @@
+import asyncio
 import logging
-from datetime import datetime
+import math
+from datetime import datetime, timedelta
 
 from typing import Any
 
 import voluptuous as vol
 
 from homeassistant.core import HomeAssistant, ServiceCall, SupportsResponse
+from homeassistant.exceptions import ServiceValidationError
 from homeassistant.helpers.aiohttp_client import async_get_clientsession
 import homeassistant.helpers.config_validation as cv
 from homeassistant.util import dt as dt_util
 
-from .const import _REGIONS
-
+from .const import _REGIONS, MAX_CONCURRENT_FETCHES, RANGE_MAX_DAYS
+from .costs import CostEvaluator
+from .series import PriceSeries
 
 _LOGGER = logging.getLogger(__name__)
 
 
-def check_setting(value):
+def check_setting(ensure_list):
+    """Validator for a list of areas, ensure_list makes the value a list."""
+
     def validator(value):
+        value = ensure_list(value)
         c = any([i for i in value if i in list(_REGIONS.keys())])
         if c is not True:
-            vol.Invalid(
+            raise vol.Invalid(
                 f"{value} in not in on of the supported areas {','.join(_REGIONS.keys())}"
             )
         return value
@@ -32,27 +39,113 @@ HOURLY_SCHEMA = vol.Schema(
     {
         vol.Required("currency"): str,
         vol.Required("date"): cv.date,
-        vol.Required("area"): check_setting(cv.ensure_list),
+        vol.Required("area"): check_setting(cv.ensure_list_csv),
     }
 )
 
 
+def check_range(value):
+    if value["end_date"] < value["start_date"]:
+        raise vol.Invalid("end_date must not be before start_date")
+    if (value["end_date"] - value["start_date"]).days >= RANGE_MAX_DAYS:
+        raise vol.Invalid(f"The range can be at most {RANGE_MAX_DAYS} days")
+    return value
+
+
+RANGE_SCHEMA = vol.All(
+    vol.Schema(
+        {
+            vol.Required("currency"): vol.All(cv.ensure_list_csv, [str]),
+            vol.Required("start_date"): cv.date,
+            vol.Required("end_date"): cv.date,
+            vol.Required("area"): check_setting(cv.ensure_list_csv),
+        }
+    ),
+    check_range,
+)
+
+
 YEAR_SCHEMA = vol.Schema(
     {
         vol.Required("currency"): str,
         vol.Required("year", default=dt_util.now().strftime("Y")): cv.matches_regex(
             r"^[1|2]\d{3}$"
         ),
-        vol.Required("area"): check_setting(cv.ensure_list),
+        vol.Required("area"): check_setting(cv.ensure_list_csv),
+        vol.Optional("vat"): vol.All(vol.Coerce(float), vol.Range(min=0, max=1)),
+        vol.Optional("additional_costs"): cv.template,
     }
 )
 
 
-async def async_setup_services(hass: HomeAssistant):
+CHEAPEST_SCHEMA = vol.All(
+    vol.Schema(
+        {
+            vol.Required("entity_id"): cv.entity_ids,
+            vol.Optional("duration"): cv.positive_time_period,
+            vol.Optional("count"): vol.All(vol.Coerce(int), vol.Range(min=1)),
+            vol.Optional("start"): cv.datetime,
+            vol.Optional("end"): cv.datetime,
+        }
+    ),
+    cv.has_at_least_one_key("duration", "count"),
+)
+
+
+def _aware(value):
+    """Datetimes from the action without a timezone are in local time."""
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=dt_util.DEFAULT_TIME_ZONE)
+    return value
+
+
+def price_basis(hass, sc):
+    """A function that puts a PriceSeries in the same basis as a sensor
+    with kWh, VAT and additional_costs, None if the call doesn't ask for it.
+    """
+    if "vat" not in sc and "additional_costs" not in sc:
+        return None
+
+    vat = 1 + sc.get("vat", 0)
+    costs = None
+    if "additional_costs" in sc:
+        template = sc["additional_costs"]
+        template.hass = hass
+        costs = CostEvaluator(template)
+        if not costs.static:
+            # A year of rows would be rendered on the event loop.
+            raise ServiceValidationError(
+                "additional_costs for the averages can only use now() and "
+                "current_price"
+            )
+
+    def price(series):
+        rows = list(series.rows())
+        prices = [value / 1000 * vat for _, _, value in rows]
+        if costs is not None and series.mtu > 3600 and costs.reads_time:
+            # An average from the api, the costs by the time are unknown.
+            prices = [math.nan for _ in prices]
+        elif costs is not None:
+            starts = [start for start, _, _ in series.slots(dt_util.DEFAULT_TIME_ZONE)]
+            extra = costs.evaluate_many(list(zip(starts, prices)))
+            prices = [p + c for p, c in zip(prices, extra)]
+        return PriceSeries.from_rows(
+            [(start, end, p) for (start, end, _), p in zip(rows, prices)]
+        )
+
+    return price
+
+
+async def async_setup_services(
+    hass: HomeAssistant, client=None, cache=None, history=None, sensors=None
+):
     _LOGGER.debug("Setting up services")
     from .aio_price import AioPrices
+    from .client import PriceClient
 
-    client = async_get_clientsession(hass)
+    # Share the connections and the response cache between the calls.
+    if client is None:
+        client = PriceClient(async_get_clientsession(hass))
 
     async def hourly(service_call: ServiceCall) -> Any:
         sc = service_call.data
@@ -63,20 +156,98 @@ async def async_setup_services(hass: HomeAssistant):
             year=sc["date"].year, month=sc["date"].month, day=sc["date"].day
         )
 
-        value = await AioPrices(sc["currency"], client).hourly(
-            areas=sc["area"], end_date=end_date, raw=True
-        )
+        value = await AioPrices(
+            sc["currency"], client, cache=cache, history=history
+        ).hourly(areas=sc["area"], end_date=end_date, raw=True)
 
         _LOGGER.debug("Got value %r", value)
         return value
 
+    async def hourly_range(service_call: ServiceCall) -> Any:
+        sc = service_call.data
+        _LOGGER.debug("called hourly_range with %r", sc)
+
+        days = (sc["end_date"] - sc["start_date"]).days + 1
+        dates = [sc["start_date"] + timedelta(days=i) for i in range(days)]
+        areas = list(dict.fromkeys(sc["area"]))
+        currencies = list(dict.fromkeys(sc["currency"]))
+
+        # Every currency and date at the same time, but only a few requests
+        # to the api at once.
+        limit = asyncio.Semaphore(MAX_CONCURRENT_FETCHES)
+        res = await asyncio.gather(
+            *[
+                AioPrices(currency, client, cache=cache, history=history).raw_days(
+                    dates, areas, limit=limit
+                )
+                for currency in currencies
+            ]
+        )
+
+        # One raw response per currency and delivery date.
+        value = {
+            currency: {day.isoformat(): raw for day, raw in days.items()}
+            for currency, days in zip(currencies, res)
+        }
+        _LOGGER.debug(
+            "Got %s days for %s", [len(i) for i in value.values()], currencies
+        )
+        return value
+
+    async def cheapest(service_call: ServiceCall) -> Any:
+        sc = service_call.data
+        _LOGGER.debug("called cheapest with %r", sc)
+
+        value = {}
+        for entity_id in sc["entity_id"]:
+            sensor = (sensors or {}).get(entity_id)
+            if sensor is None:
+                raise ServiceValidationError(f"{entity_id} is not a nordpool sensor")
+            res = sensor.cheapest(
+                sc.get("duration"),
+                sc.get("count"),
+                _aware(sc.get("start")),
+                _aware(sc.get("end")),
+            )
+            # Plain json like the other actions.
+            if res.get("window"):
+                res["window"] = {
+                    k: v.isoformat() if k != "average" else v
+                    for k, v in res["window"].items()
+                }
+            for slot in res.get("slots", []):
+                slot["start"] = slot["start"].isoformat()
+                slot["end"] = slot["end"].isoformat()
+            value[entity_id] = res
+        return value
+
+    async def aggregates(sc, kind):
+        """The aggregates from the api or the history, only the history
+        can put them in the basis of a sensor.
+        """
+        spot = AioPrices(sc["currency"], client, cache=cache, history=history)
+        price = price_basis(hass, sc)
+        if price is None:
+            return await getattr(spot, kind)(areas=sc["area"], end_date=sc["year"])
+
+        if history is None:
+            raise ServiceValidationError("vat and additional_costs needs the history")
+        data_type = spot.YEARLY if kind == "yearly" else spot.DAILY
+        areas = sc["area"]
+        if isinstance(areas, str):
+            areas = [i.strip() for i in areas.split(",")]
+        value = await spot.aggregates(
+            sc["year"], areas, data_type=data_type, price=price
+        )
+        if value is None:
+            raise ServiceValidationError(f"There are no prices for {sc['year']} yet")
+        return value
+
     async def yearly(service_call: ServiceCall):
         sc = service_call.data
         _LOGGER.debug("called yearly with %r", sc)
 
-        value = await AioPrices(sc["currency"], client).yearly(
-            areas=sc["area"], end_date=sc["year"]
-        )
+        value = await aggregates(sc, "yearly")
 
         _LOGGER.debug("Got value %r", value)
         return value
@@ -85,9 +256,7 @@ async def async_setup_services(hass: HomeAssistant):
         sc = service_call.data
         _LOGGER.debug("called weekly with %r", sc)
 
-        value = await AioPrices(sc["currency"], client).yearly(
-            areas=sc["area"], end_date=sc["year"]
-        )
+        value = await aggregates(sc, "weekly")
 
         _LOGGER.debug("Got value %r", value)
         return value
@@ -96,9 +265,7 @@ async def async_setup_services(hass: HomeAssistant):
         sc = service_call.data
         _LOGGER.debug("called monthly with %r", sc)
 
-        value = await AioPrices(sc["currency"], client).monthly(
-            areas=sc["area"], end_date=sc["year"]
-        )
+        value = await aggregates(sc, "monthly")
         _LOGGER.debug("Got value %r", value)
         return value
 
@@ -106,9 +273,7 @@ async def async_setup_services(hass: HomeAssistant):
         sc = service_call.data
         _LOGGER.debug("called daily with %r", sc)
 
-        value = await AioPrices(sc["currency"], client).daily(
-            areas=sc["area"], end_date=sc["year"]
-        )
+        value = await aggregates(sc, "daily")
         _LOGGER.debug("Got value %r", value)
         return value
 
@@ -119,6 +284,20 @@ async def async_setup_services(hass: HomeAssistant):
         schema=HOURLY_SCHEMA,
         supports_response=SupportsResponse.OPTIONAL,
     )
+    hass.services.async_register(
+        domain="nordpool",
+        service="hourly_range",
+        service_func=hourly_range,
+        schema=RANGE_SCHEMA,
+        supports_response=SupportsResponse.OPTIONAL,
+    )
+    hass.services.async_register(
+        domain="nordpool",
+        service="cheapest",
+        service_func=cheapest,
+        schema=CHEAPEST_SCHEMA,
+        supports_response=SupportsResponse.ONLY,
+    )
     hass.services.async_register(
         domain="nordpool",
         service="yearly",
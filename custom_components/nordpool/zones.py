@@ -0,0 +1,63 @@
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+
+from homeassistant.util import dt as dt_utils
+
+from .const import MARKET_TZ, tzs
+
+__all__ = ["async_load_zones", "zone", "market_zone", "local_date", "day_bounds"]
+
+# Area -> tzinfo, resolved once by async_load_zones.
+ZONES = {}
+_loaded = False
+
+
+async def async_load_zones() -> None:
+    """Resolve the timezone of every area and the market without blocking,
+    after this zone and day_bounds never touches the disk.
+    """
+    global _loaded
+    if _loaded:
+        return
+    zones = {}
+    for area, name in tzs.items():
+        zones[area] = await dt_utils.async_get_time_zone(name)
+    zones[None] = await dt_utils.async_get_time_zone(MARKET_TZ)
+    ZONES.update(zones)
+    _loaded = True
+
+
+def zone(area):
+    """The timezone of the area or None for the areas we don't know."""
+    res = ZONES.get(area)
+    if res is None and area in tzs:
+        # Not loaded yet, this might read the zone from disk.
+        res = ZONES[area] = dt_utils.get_time_zone(tzs[area])
+    return res
+
+
+def market_zone():
+    """CET, the timezone of the delivery days."""
+    res = ZONES.get(None)
+    if res is None:
+        res = ZONES[None] = dt_utils.get_time_zone(MARKET_TZ)
+    return res
+
+
+def local_date(area, dt) -> date:
+    """The date in the area at dt, or in the market for unknown areas."""
+    return dt.astimezone(zone(area) or market_zone()).date()
+
+
+@lru_cache(maxsize=1024)
+def day_bounds(area, day, mtu=3600):
+    """(start, end, slot_count) of the local day in the area, epoch seconds.
+    The area None is the delivery day in the market.
+
+    It's 23 or 25 hours on the dst days, slot_count is the number of mtu
+    long slots in it.
+    """
+    tz = zone(area) or market_zone()
+    start = int(datetime.combine(day, time(), tz).timestamp())
+    end = int(datetime.combine(day + timedelta(days=1), time(), tz).timestamp())
+    return start, end, (end - start) // mtu